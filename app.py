@@ -7,26 +7,45 @@ from PIL import (
 from pathlib import Path
 from time import (
     sleep,
-    time
+    time,
+    perf_counter,
 )
-import os
 import pyautogui
 import tkinter as tk
 from capture import CaptureSet
+from preprocess import (
+    Preprocessor,
+    auto_scale,
+)
+from ocr import (
+    TESSERACT_PRESETS,
+    OCREngine,
+    OCRPool,
+    AreaKey,
+    TesseractEngine,
+    consensus,
+    EasyOCREngine,
+)
+from workers import OCRProcessPool
+from governor import CPUGovernor
+from threads import ThreadBudget
+from text_stream import TextGlosser
+from bench import LookupBenchmark
+from importlib.util import find_spec
 from util import (
-    first,
-    on_windows,
-    combine_columns,
-    make_column,
-    clear_tty,
+    layout_columns,
+    TerminalRenderer,
+    LRUCache,
     Color,
     nothing,
+    first,
+    overlap,
+    mask_box,
 )
 from typing import (
     Iterable,
 )
 from kanji_translator import KanjiTranslator
-from itertools import islice
 from contextlib import contextmanager
 from logging import (
     getLogger,
@@ -35,12 +54,25 @@ from logging import (
 )
 from log import (
     configure_logger,
+    FlightRecorder,
     TRACE
 )
 from command import Commands
+from memory import MemoryMonitor
+from prefetch import Prefetcher
+from text_index import TextIndex
+from server import StreamServer
+from cache import (
+    ResultCache,
+    image_key,
+)
+from profiler import (
+    SamplingProfiler,
+    SpanTracer,
+    stage,
+)
 import pstats
 import cProfile
-import numpy
 from textwrap import wrap
 
 
@@ -49,23 +81,11 @@ log = getLogger('app')
 
 FWS = '　'
 
-TESSERACT_SEARCH_PATHS = [
-    Path(r'C:\Program Files\Tesseract-OCR\tesseract.exe'),
-    Path(r'C:\Program Files (x86)\Tesseract-OCR\tesseract.exe'),
-]
-
-if 'TESSERACT_PATH' in os.environ:
-    TESSERACT_SEARCH_PATHS.append(Path(
-        os.environ['TESSERA_PATH']
-    ))
-    TESSERACT_SEARCH_PATHS.append(
-        Path(os.environ['TESSERA_PATH']) / 'tesseract.exe'
-    )
-
-
 class Tooltip(tk.Tk):
     offset_x = 64
     offset_y = 64
+    # Distance kept from the region returned by `avoid`
+    margin = 8
     labels = []
     texts = []
     images = []
@@ -80,10 +100,13 @@ class Tooltip(tk.Tk):
         self,
         font_size: float = 12,
         *args,
+        avoid=None,
         **kwargs
     ):
         super().__init__(*args, **kwargs)
         self.font_size = font_size
+        # avoid(x, y) is the screen region to keep clear for cursor x, y
+        self.avoid = avoid
         bg = 'black'
         self.overrideredirect(True)
         self.attributes('-alpha', 0.9)
@@ -129,10 +152,50 @@ class Tooltip(tk.Tk):
     def show(self):
         self.deiconify()
 
+    def rect(self) -> tuple[int, int, int, int] | None:
+        if not self.winfo_viewable():
+            return None
+        x = self.winfo_rootx()
+        y = self.winfo_rooty()
+        return (x, y, x + self.winfo_width(), y + self.winfo_height())
+
+    def _clear_of(
+        self,
+        region: tuple,
+        x: int,
+        y: int,
+        w: int,
+        h: int,
+        screen_width: int,
+        screen_height: int
+    ) -> tuple[int, int]:
+        """
+        A position near `x, y` where the window does not cover `region`:
+        below, above, right or left of it, whichever fits on the screen
+        first. `x, y` if the window is clear or fits nowhere.
+        """
+        if not overlap((x, y, x + w, y + h), region):
+            return x, y
+        candidates = [
+            (x, region[3] + self.margin),
+            (x, region[1] - h - self.margin),
+            (region[2] + self.margin, y),
+            (region[0] - w - self.margin, y),
+        ]
+        for cx, cy in candidates:
+            if (
+                0 <= cx <= screen_width - w
+                and 0 <= cy <= screen_height - h
+                and not overlap((cx, cy, cx + w, cy + h), region)
+            ):
+                return cx, cy
+        return x, y
+
     def update(self):
         for label in self.labels:
             label.pack_forget()
             label.destroy()
+        self.labels = []
         self.photoImages = [
             ImageTk.PhotoImage(image)
             for image in self.images
@@ -177,6 +240,16 @@ class Tooltip(tk.Tk):
             x -= w + 2 * self.offset_x
         if y + h > screen_height:
             y -= h + 2 * self.offset_y
+        if self.avoid:
+            x, y = self._clear_of(
+                self.avoid(*pyautogui.position()),
+                x,
+                y,
+                w,
+                h,
+                screen_width,
+                screen_height
+            )
         self.geometry(f'{w}x{h}+{x}+{y}')
         super().update()
         super().update_idletasks()
@@ -195,26 +268,114 @@ class App:
         force_interval (float): The time in seconds to wait before forcing a
             new capture.
         gui (bool): Whether to show a tooltip with the translation.
-        clear_tty (bool): Whether to clear terminal between prints.
+        clear_tty (bool): Whether to redraw the output in place instead of
+            printing each frame below the previous one.
         max_entries (int): The maximum number of entries to show in the
             tooltip.
         gui_colors (list[str]): The colors to use for the tooltip entries.
         debug (bool): Whether to log debug messages.
         trace (bool): Whether to log trace messages.
+        flight_recorder (int): The number of recent trace and debug records
+            to keep in memory, 0 to disable. They are written to a file on
+            SIGUSR2, on uncaught exceptions and on slow frames.
+        flight_prefix (str): The path prefix of the flight recorder files.
+        flight_latency (float): Write the flight recorder when a frame takes
+            longer than this many seconds, 0 to disable.
         profile (bool | str): Whether to profile the code. If a string is
             provided, it will be used as the file name for the profile stats.
+        sample_profile (bool | str): Whether to start the sampling profiler
+            right away. If a string is provided, it will be used as the path
+            prefix of the collapsed stack files. Once started, the profiler
+            can be stopped and started again with SIGUSR1.
+        sample_interval (float): The time in seconds between profiler
+            samples.
+        sample_flush (float): The time in seconds between writing profiler
+            samples to disk.
+        span_trace (bool | str): Whether to write the pipeline stages of
+            all threads as Chrome trace events, viewable in Perfetto. If a
+            string is provided, it will be used as the path prefix.
+        cpu_target (float): Keep the CPU use of the process under this
+            fraction of one core, e.g. 0.15, by lowering quality in steps:
+            fewer scales, fewer divs, a cheaper Tesseract preset and then
+            longer intervals. Quality is restored when the machine is idle.
+            0 disables the governor.
+        cpu_window (float): The CPU measurement window in seconds.
+        memory_monitor (int): Report memory growth every this many loops.
+            0 disables the monitor.
+        memory_top (int): The number of growing allocation sites to report.
+        result_cache (bool): Whether to cache OCR text and dictionary entries
+            by the content of the capture, so repeated screens skip OCR.
+        result_cache_dir (str): Directory for the persistent cache tier.
+            If not set, results are only cached in memory.
+        result_cache_entries (int): The number of results cached in memory.
+        result_cache_mb (float): The size limit of the persistent cache in
+            megabytes.
+        prefetch (bool): Whether to capture and OCR ahead of the cursor
+            while waiting, along its predicted path.
+        prefetch_steps (int): The number of intervals to look ahead.
+        index_area (str | tuple): Screen area `x0,y0,x1,y1` (or `screen`) to
+            OCR into a text index. Hovering then queries the index instead of
+            capturing, and only changed tiles of the area are re-OCRed.
+        index_tile (int): The tile size of the text index in pixels.
+        index_refresh (float): The time in seconds between checking the
+            indexed area for changed tiles.
+        serve (bool | int): Whether to publish frames on a local HTTP server
+            (server-sent events on /events, lookups on /lookup). If an int
+            is provided, it will be used as the port.
+        serve_host (str): The address the server listens on.
+        serve_origins (str | list[str]): Comma separated origins of web
+            pages allowed to read the server from a browser, `*` for any.
+            None by default, as frames show the screen contents.
+        serve_queue (int): The number of frames buffered per client before
+            the client is dropped.
         pretty (bool): Whether to use pretty printing for logs.
         capture_preview (bool): Whether to show a preview of the capture in
             the tooltip.
         tesseract (bool): Whether to use Tesseract for OCR.
+        tesseract_preset (str): The Tesseract speed/accuracy preset,
+            `fast`, `balanced` or `accurate`. `fast` and `balanced` run a
+            single pass in the mode matching the text orientation.
+        tesseract_psm (int): Always use this Tesseract page segmentation
+            mode, e.g. 5 for vertical or 6 for horizontal text, instead of
+            the modes of the preset.
         easyocr (bool): Whether to use EasyOCR for OCR.
+        easyocr_reuse (bool): Whether to reuse the EasyOCR text boxes of the
+            previous capture of the same area and only re-recognise the
+            boxes that changed.
+        ocr_timeout (float): The time in seconds to wait for each OCR engine
+            before skipping its result.
+        ocr_warmup (bool): Whether to warm up the OCR engines before the
+            first capture.
+        ocr_alternates (int): The number of alternative OCR readings looked
+            up besides the consensus of all readings.
+        ocr_processes (int): The number of worker processes to run OCR in,
+            0 to run it in threads of this process. Frames are passed to
+            the workers through shared memory.
+        threads (int): The number of CPU threads OCR may use in total,
+            0 for the libraries' defaults. The threads are split between
+            the worker processes, or between the engines without them, and
+            set as torch threads and Tesseract's `OMP_THREAD_LIMIT`. There
+            are never more worker processes than threads.
+        pin_threads (bool): Whether to pin every OCR worker process to its
+            own CPUs, and this process to the CPUs of `threads`.
         scales (int): Number of scaled versions of the capture to use for OCR.
         divs (int): Divide capture region to multiplw parts for OCR.
+        auto_scale (bool): Whether to estimate the text height in the
+            capture and OCR a single version scaled to the engine's
+            preferred text height, instead of the `scales` ladder.
+        text_height (int): The text height to scale to with `auto_scale`.
+            Defaults to the preferred height of the first OCR engine.
         kanji_column (int): The width of the kanji column in the tooltip.
         kana_column (int): The width of the kana column in the tooltip.
         gloss_column (int): The width of the gloss column in the tooltip.
         capture_column (int): The width of the capture column in the tooltip.
         font_size (float): The font size to use in the tooltip.
+        row_cache_size (int): The number of formatted entry rows to cache.
+        preprocess (bool | str): Whether to clean up captures before OCR.
+            Either True for all steps or comma separated steps from
+            `invert`, `normalize` and `binarize`.
+        preprocess_bits (int): Bit depth of the images passed to the OCR
+            engines when preprocessing, 8 or 1.
     """
 
     capture_size_x: int = 160
@@ -225,6 +386,8 @@ class App:
     prev_capture_x: int = 0
     prev_capture_y: int = 0
     capture_threshold: int = 16
+    # Grid in screen pixels of the areas OCR engines cache layouts by
+    layout_snap: int = 64
     interval: float = 0.5
     force_interval: float = 10.0
     _tooltip: Tooltip = None
@@ -237,16 +400,66 @@ class App:
         for _ in range(8)
     ]
     profile: bool | str = False
+    sample_profile: bool | str = False
+    sample_interval: float = SamplingProfiler.interval
+    sample_flush: float = SamplingProfiler.flush_interval
+    span_trace: bool | str = False
+    span_tracer: SpanTracer | None = None
+    cpu_target: float = 0
+    cpu_window: float = CPUGovernor.window
+    governor: CPUGovernor | None = None
+    # Tesseract preset waiting for the engine lock
+    pending_preset: str | None = None
+    memory_monitor: int = 0
+    memory_top: int = MemoryMonitor.top
+    result_cache: bool = False
+    result_cache_dir: str | None = None
+    result_cache_entries: int = ResultCache.entries
+    result_cache_mb: float = ResultCache.max_mb
+    prefetch: bool = False
+    prefetch_steps: int = Prefetcher.steps
+    prefetcher: Prefetcher | None = None
+    index_area: str | tuple | None = None
+    index_tile: int = TextIndex.tile_size
+    index_refresh: float = 2.0
+    text_index: TextIndex | None = None
+    index_boxes: tuple = ()
+    serve: bool | int = False
+    serve_host: str = StreamServer.host
+    serve_origins: str | tuple = StreamServer.allow_origins
+    serve_queue: int = StreamServer.queue_size
+    server: StreamServer | None = None
+    frame_id: int = 0
+    capture_key: str | None = None
+    capture: CaptureSet | None = None
+    cached: dict | None = None
     pretty: bool = False
     capture_preview: bool = True
-    pytesseract = None
-    easyocr_reader = None
     tesseract: bool | None = None
+    tesseract_preset: str = TesseractEngine.preset
+    tesseract_psm: int | None = None
     easyocr: bool | None = None
+    easyocr_reuse: bool = False
+    ocr_timeout: float = 10.0
+    ocr_warmup: bool = True
+    ocr_alternates: int = 2
+    ocr_processes: int = 0
+    threads: int = 0
+    pin_threads: bool = False
+    thread_budget: ThreadBudget | None = None
+    thread_allocation: dict | None = None
+    ocr_engines: list = None
+    ocr_pool: OCRPool | OCRProcessPool = None
     debug: bool = False
     trace: bool = False
+    flight_recorder: int = 0
+    flight_prefix: str = FlightRecorder.prefix
+    flight_latency: float = 0
+    recorder: FlightRecorder | None = None
     scales: int = None
     divs: int = None
+    auto_scale: bool = False
+    text_height: int | None = None
     kanji_column: int = 4
     kana_column: int = 6
     gloss_column: int = 60
@@ -254,6 +467,10 @@ class App:
     text: str = ''
     capture_text: str = ''
     font_size: float = 11
+    row_cache_size: int = 256
+    preprocess: bool | str = False
+    preprocess_bits: int = 8
+    preprocessor: Preprocessor | None = None
 
     def __init__(
         self,
@@ -271,18 +488,56 @@ class App:
         gui_colors: Iterable[Color] = gui_colors,
         debug: bool = debug,
         trace: bool = trace,
+        flight_recorder: int = flight_recorder,
+        flight_prefix: str = flight_prefix,
+        flight_latency: float = flight_latency,
         profile: bool | str = profile,
+        sample_profile: bool | str = sample_profile,
+        sample_interval: float = sample_interval,
+        sample_flush: float = sample_flush,
+        span_trace: bool | str = span_trace,
+        cpu_target: float = cpu_target,
+        cpu_window: float = cpu_window,
+        memory_monitor: int = memory_monitor,
+        memory_top: int = memory_top,
+        result_cache: bool = result_cache,
+        result_cache_dir: str | None = result_cache_dir,
+        result_cache_entries: int = result_cache_entries,
+        result_cache_mb: float = result_cache_mb,
+        prefetch: bool = prefetch,
+        prefetch_steps: int = prefetch_steps,
+        index_area: str | tuple | None = index_area,
+        index_tile: int = index_tile,
+        index_refresh: float = index_refresh,
+        serve: bool | int = serve,
+        serve_host: str = serve_host,
+        serve_origins: str | tuple = serve_origins,
+        serve_queue: int = serve_queue,
         pretty: bool = pretty,
         capture_preview: bool | None = capture_preview,
         tesseract: bool | None = tesseract,
+        tesseract_preset: str = tesseract_preset,
+        tesseract_psm: int | None = tesseract_psm,
         easyocr: bool | None = easyocr,
+        easyocr_reuse: bool = easyocr_reuse,
+        ocr_timeout: float = ocr_timeout,
+        ocr_warmup: bool = ocr_warmup,
+        ocr_alternates: int = ocr_alternates,
+        ocr_processes: int = ocr_processes,
+        threads: int = threads,
+        pin_threads: bool = pin_threads,
         scales: int  | None = None,
         divs: int | None = divs,
+        auto_scale: bool = auto_scale,
+        text_height: int | None = text_height,
         kanji_column: int = kanji_column,
         kana_column: int = kana_column,
         gloss_column: int = gloss_column,
         capture_column: int = capture_column,
         font_size: float = font_size,
+        row_cache_size: int = row_cache_size,
+        preprocess: bool | str = preprocess,
+        preprocess_bits: int = preprocess_bits,
     ):
         self.capture_size_x = capture_size_x
         self.capture_size_y = capture_size_y
@@ -293,9 +548,58 @@ class App:
         self.force_interval = force_interval
         self.gui = gui
         self.clear_tty = clear_tty
+        self.renderer = TerminalRenderer() if clear_tty else None
+        self.printed = None
         self.max_entries = max_entries
         self.gui_colors = gui_colors
         self.profile = profile
+        self.sample_profile = sample_profile
+        self.sampling_profiler = SamplingProfiler(
+            **(
+                {'prefix': sample_profile}
+                if isinstance(sample_profile, str)
+                else {}
+            ),
+            interval=sample_interval,
+            flush_interval=sample_flush,
+        )
+        self.span_tracer = (
+            SpanTracer(
+                **(
+                    {'prefix': span_trace}
+                    if isinstance(span_trace, str)
+                    else {}
+                ),
+            )
+            if span_trace
+            else None
+        )
+        self.cpu_target = cpu_target
+        self.cpu_window = cpu_window
+        self.memory_monitor = (
+            MemoryMonitor(every=memory_monitor, top=memory_top)
+            if memory_monitor
+            else None
+        )
+        self.result_cache = (
+            ResultCache(
+                entries=result_cache_entries,
+                path=result_cache_dir,
+                max_mb=result_cache_mb,
+            )
+            if result_cache
+            else None
+        )
+        self.prefetch = prefetch
+        self.prefetch_steps = prefetch_steps
+        self.index_area = index_area
+        self.index_tile = index_tile
+        self.index_refresh = index_refresh
+        self.index_infos = LRUCache(row_cache_size)
+        self.serve = serve
+        self.serve_host = serve_host
+        self.serve_origins = serve_origins
+        self.serve_queue = serve_queue
         self.log_level = (
             TRACE
             if trace
@@ -305,38 +609,104 @@ class App:
         )
         self.pretty = pretty
         self.capture_preview = capture_preview
+        self.ocr_timeout = ocr_timeout
+        self.ocr_warmup = ocr_warmup
+        self.ocr_alternates = ocr_alternates
+        self.ocr_processes = ocr_processes
+        self.thread_budget = (
+            ThreadBudget(threads=threads, pin=pin_threads)
+            if threads or pin_threads
+            else None
+        )
+        if self.thread_budget:
+            self.ocr_processes = self.thread_budget.processes(ocr_processes)
+        self.easyocr_reuse = easyocr_reuse
+        self.tesseract_preset = tesseract_preset
+        self.tesseract_psm = tesseract_psm
+        self.ocr_engines = []
         if tesseract:
             self.setup_tesseract()
         if easyocr:
             self.setup_easyocr()
         if not self.tesseract and not self.easyocr:
             self.auto_select_ocr()
+        if self.thread_budget:
+            self.thread_allocation = self.thread_budget.apply(
+                self.ocr_engines,
+                self.ocr_processes
+            )
+        self.ocr_pool = (
+            OCRProcessPool(
+                self.ocr_engines,
+                processes=self.ocr_processes,
+                cpus=(
+                    self.thread_allocation
+                    and self.thread_allocation['worker_cpus']
+                ),
+            )
+            if self.ocr_processes
+            else OCRPool(self.ocr_engines)
+        )
         self.scales = scales
         self.divs = divs
+        self.auto_scale = auto_scale
+        self.text_height = (
+            text_height
+            or self.ocr_engines[0].preferred_height
+        )
         self.kanji_column = kanji_column
         self.kana_column = kana_column
         self.gloss_column = gloss_column
         self.capture_column = capture_column
         self.font_size = font_size
-        configure_logger('app', level=self.log_level, pretty=self.pretty)
+        self.row_cache = LRUCache(row_cache_size)
+        self.preprocess = preprocess
+        self.preprocess_bits = preprocess_bits
+        if preprocess:
+            self.preprocessor = Preprocessor(
+                **({} if preprocess is True else {'steps': preprocess}),
+                bits=preprocess_bits
+            )
+        self.flight_latency = flight_latency
+        self.recorder = (
+            FlightRecorder(capacity=flight_recorder, prefix=flight_prefix)
+            if flight_recorder
+            else None
+        )
+        configure_logger(
+            'app',
+            level=self.log_level,
+            pretty=self.pretty,
+            recorder=self.recorder
+        )
         configure_logger(None, level=self.log_level, pretty=self.pretty)
 
     def setup_easyocr(self):
-        from easyocr import Reader
-        self.easyocr_reader = Reader(['ja'])
+        engine = EasyOCREngine(
+            reuse_detection=self.easyocr_reuse,
+            timeout=self.ocr_timeout
+        )
+        self._setup_engine(engine, 'easyocr')
+        self.ocr_engines.append(engine)
         self.easyocr = True
 
     def setup_tesseract(self):
-        import pytesseract
-        self.pytesseract = pytesseract
-        tesseract_exe = first([
-            p for p in TESSERACT_SEARCH_PATHS
-            if p.exists() and p.is_file()
-        ])
-        if on_windows():
-            self.pytesseract.pytesseract.tesseract_cmd = str(tesseract_exe)
+        engine = TesseractEngine(
+            preset=self.tesseract_preset,
+            psms=[self.tesseract_psm] if self.tesseract_psm else None,
+            timeout=self.ocr_timeout
+        )
+        self._setup_engine(engine, 'pytesseract')
+        self.ocr_engines.append(engine)
         self.tesseract = True
 
+    def _setup_engine(self, engine: OCREngine, module: str):
+        # Worker processes set up their own copies of the engines
+        if not self.ocr_processes:
+            engine.setup()
+        elif find_spec(module) is None:
+            raise ImportError(f'No module named {module!r}')
+
     def auto_select_ocr(self):
         try:
             self.setup_easyocr()
@@ -355,88 +725,212 @@ class App:
         kwargs = {}
         if self.divs:
             kwargs['auto_parts'] = (self.divs, self.divs)
-        if self.scales:
+        if self.auto_scale:
+            scale = auto_scale(img, self.text_height)
+            log.debug({
+                'message': 'Auto scale',
+                'scale': scale,
+            })
+            kwargs['scales'] = [scale]
+        elif self.scales:
             kwargs['scales'] = [
                 1 / (2 ** (i))
                 for i in range(self.scales)
             ]
         return CaptureSet(img, **kwargs)
 
-    def _capture(self):
+    def _region(self, x: int, y: int) -> tuple[int, int, int, int]:
+        return (
+            x - self.capture_size_x // 2 + self.capture_offset_x,
+            y - self.capture_size_y // 2 + self.capture_offset_y,
+            x + self.capture_size_x // 2 + self.capture_offset_x,
+            y + self.capture_size_y // 2 + self.capture_offset_y,
+        )
+
+    def _mark_capture(self):
         self.prev_capture_time = time()
         self.prev_capture_x = self.x
         self.prev_capture_y = self.y
-        region = (
-            self.x - self.capture_size_x // 2 + self.capture_offset_x,
-            self.y - self.capture_size_y // 2 + self.capture_offset_y,
-            self.x + self.capture_size_x // 2 + self.capture_offset_x,
-            self.y + self.capture_size_y // 2 + self.capture_offset_y,
-        )
-        with self.tooltip.hidden() if self.gui else nothing():
+
+    def _tooltip_over(self, region: tuple) -> tuple | None:
+        """The part of `region` the tooltip covers, if any."""
+        if not self.gui:
+            return None
+        rect = self.tooltip.rect()
+        return rect and overlap(rect, region)
+
+    def _grab(self, region: tuple) -> Image:
+        """
+        Grab `region` of the screen without hiding the tooltip.
+
+        The tooltip is placed clear of the capture region, but the cursor
+        may have moved since. Whatever part of it is still in the region is
+        masked, rather than withdrawing and remapping the window.
+        """
+        with stage('grab', region=region) as span:
+            covered = self._tooltip_over(region)
             img = ImageGrab.grab(region)
+            if covered:
+                img = mask_box(img, (
+                    covered[0] - region[0],
+                    covered[1] - region[1],
+                    covered[2] - region[0],
+                    covered[3] - region[1],
+                ))
+            span['masked'] = bool(covered)
+        return img
+
+    def _capture(self):
+        self._mark_capture()
+        region = self._region(self.x, self.y)
+        img = self._grab(region)
+        with stage('capture_set', size=img.size) as span:
             self.capture = self._capture_set(img)
-        text = ''.join([
-            self._ocr(img)
-            for img in self.capture.images()
-        ])
+            images = self.capture.images()
+            span['images'] = len(images)
+        images = [self._preprocess(img) for img in images]
+        if self.result_cache:
+            with stage('cache') as span:
+                self.capture_key = image_key(images, self._ocr_config())
+                self.cached = self.result_cache.get(self.capture_key)
+                span['hit'] = self.cached is not None
+            if self.cached:
+                return self.cached['text']
+        return self._read(images, self.capture.scales, region)
+
+    def _prefetch_capture(self, x: int, y: int, alive) -> tuple | None:
+        region = self._region(x, y)
+        img = ImageGrab.grab(region)
+        capture = self._capture_set(img)
+        images = [self._preprocess(img) for img in capture.images()]
+        text = self._read(images, capture.scales, region, alive)
+        if text is None:
+            return None
+        key = (
+            image_key(images, self._ocr_config())
+            if self.result_cache
+            else None
+        )
+        return capture, text, key
+
+    def _prefetch_allowed(self, x: int, y: int) -> bool:
+        if not self.gui:
+            return True
+        rect = self.tooltip.rect()
+        if not rect:
+            return True
+        x0, y0, x1, y1 = self._region(x, y)
+        return x1 <= rect[0] or x0 >= rect[2] or y1 <= rect[1] or y0 >= rect[3]
+
+    def _take_prefetched(self) -> str | None:
+        if not self.prefetcher:
+            return None
+        prefetched = self.prefetcher.take(self.x, self.y)
+        if prefetched is None:
+            return None
+        self._mark_capture()
+        # The key of the prefetched images, so their entries are not cached
+        # under the key of the previous capture
+        self.capture, text, self.capture_key = prefetched
+        self.cached = None
         return text
 
-    def _tesseract(self, img: Image):
-        log.debug({
-            'message': 'Running Tesseract',
-            'img.size': img.size,
-        })
-        if not self.pytesseract:
-            import pytesseract
-            self.pytesseract = pytesseract
-            tesseract_exe = first([
-                p for p in TESSERACT_SEARCH_PATHS
-                if p.exists() and p.is_file()
-            ])
-            if on_windows():
-                self.pytesseract.pytesseract.tesseract_cmd = str(tesseract_exe)
-        return [
-            self.pytesseract.image_to_string(
-                img,
-                lang='jpn',
-                config=f'--psm {psm}'
+    def _ocr_config(self) -> str:
+        return repr((
+            [
+                (
+                    e.name,
+                    getattr(e, 'preset', None),
+                    getattr(e, 'psms', None),
+                )
+                for e in self.ocr_engines
+            ],
+            self.preprocessor and (
+                self.preprocessor.steps,
+                self.preprocessor.bits
+            ),
+            self.scales,
+            self.auto_scale and self.text_height,
+            self.ocr_alternates,
+            self.divs,
+            self.max_entries,
+        ))
+
+    def _lookup(self, text: str) -> list[dict]:
+        if self.cached:
+            return self.cached['infos']
+        infos = self.translator.text_kanji_info(
+            text,
+            k=self.max_entries
+        )
+        if self.result_cache and self.capture_key:
+            self.result_cache.put(
+                self.capture_key,
+                {'text': text, 'infos': infos}
             )
-            for psm in [5, 6]
-        ]
+        return infos
 
-    def _easyocr(self, img: Image):
-        log.debug({
-            'message': 'Running EasyOCR',
-            'img.size': img.size,
-        })
-        if not self.easyocr_reader:
-            from easyocr import Reader
-            self.easyocr_reader = Reader(['ja'])
-        texts = [
-            v[1]
-            for v in
-            self.easyocr_reader.readtext(numpy.array(img))
-        ]
-        return texts
-
-    def _ocr(self, image: Image = None) -> str:
-        ocrs = []
-        if self.tesseract:
-            ocrs.append(self._tesseract)
-        if self.easyocr:
-            ocrs.append(self._easyocr)
-        if not ocrs:
-            raise ValueError('No OCR engines enabled')
-        texts = [
-            t
-            for ocr in ocrs
-            for t in ocr(image)
-        ]
+    def _preprocess(self, img: Image) -> Image:
+        if not self.preprocessor:
+            return img
+        with stage('preprocess'):
+            return self.preprocessor(img)
+
+    def _ocr(self, image: Image = None, key=None) -> str:
+        with stage('ocr'):
+            return self.ocr_pool(image, key)
+
+    def _area_key(self, region: tuple, i: int, scale: float) -> AreaKey:
+        """
+        The key of image `i` of a capture of `region`. Captures within the
+        same `layout_snap` grid cell share the area, so engines can reuse
+        their text boxes while the cursor moves a little.
+        """
+        snap = self.layout_snap
+        x0 = region[0] - region[0] % snap
+        y0 = region[1] - region[1] % snap
+        return AreaKey(
+            area=(x0, y0, region[2] - region[0], region[3] - region[1]),
+            index=(i, scale),
+            origin=((region[0] - x0) * scale, (region[1] - y0) * scale),
+        )
+
+    def _read(
+        self,
+        images: list[Image],
+        scales: list[float],
+        region: tuple,
+        alive=None
+    ) -> str | None:
+        """
+        OCR the images of a capture set and agree on one text.
+
+        The images are the divs of the capture, each at `scales`. The
+        result is the consensus text, then the alternates on their own
+        lines, so that lookups never combine characters across them.
+        Returns None once `alive()` is False.
+        """
+        per_div = len(scales)
+        groups = []
+        for i, img in enumerate(images):
+            if alive and not alive():
+                return None
+            if i % per_div == 0:
+                groups.append([])
+            key = self._area_key(region, i, scales[i % per_div])
+            with stage('ocr', size=img.size, image=i) as span:
+                results = self.ocr_pool.recognize(img, key)
+                span['chars'] = sum(len(r.text) for r in results)
+            groups[-1].extend(results)
+        with stage('consensus') as span:
+            texts = consensus(groups, max_alternates=self.ocr_alternates)
+            span['chars'] = len(texts[0]) if texts else 0
         log.debug({
-            'message': 'OCR results',
-            'texts': texts
+            'message': 'OCR consensus',
+            'readings': sum(len(g) for g in groups),
+            'texts': texts,
         })
-        return ''.join(texts)
+        return '\n'.join(texts)
 
     def should_capture(self):
         self.x, self.y = pyautogui.position()
@@ -445,63 +939,88 @@ class App:
             or not self.near_last_capture(self.x, self.y)
         )
 
-    def next_capture(self, hide_tooltip=True):
+    def _parse_area(self, area) -> tuple[int, int, int, int]:
+        if area == 'screen':
+            width, height = pyautogui.size()
+            return (0, 0, width, height)
+        if isinstance(area, str):
+            area = area.split(',')
+        return tuple(int(v) for v in area)
+
+    def _index_recognize(self, img: Image) -> list:
+        return self.ocr_pool.recognize_boxes(self._preprocess(img))
+
+    def next_index_capture(self):
+        """
+        Answer the capture from the text index.
+
+        Returns None when the boxes under the cursor did not change.
+        """
+        if time() > self.prev_capture_time + self.index_refresh:
+            self.prev_capture_time = time()
+            # Masking would drop the text under the tooltip from the index
+            area = self.text_index.area
+            with (
+                self.tooltip.hidden()
+                if self._tooltip_over(area)
+                else nothing()
+            ):
+                with stage('grab'):
+                    img = ImageGrab.grab(area)
+            with stage('index'):
+                self.text_index.refresh(img)
+        self.x, self.y = pyautogui.position()
+        with stage('index'):
+            boxes = tuple(self.text_index.query(self._region(self.x, self.y)))
+        if boxes == self.index_boxes:
+            return None
+        self.index_boxes = boxes
+        text = ''.join(box.text for box in boxes)
+        infos = self.index_infos.get(boxes)
+        if infos is None:
+            infos = self.translator.text_kanji_info(text, k=self.max_entries)
+            self.index_infos.put(boxes, infos)
+        self.capture = None
+        self.cached = {'text': text, 'infos': infos}
+        return text
+
+    def next_capture(self):
         if self.should_capture():
-            if self.gui:
-                with self.tooltip.hidden():
-                    return self._capture()
-            else:
-                return self._capture()
+            prefetched = self._take_prefetched()
+            if prefetched is not None:
+                return prefetched
+            return self._capture()
 
     def _loop(self):
         log.debug({'message': 'Loop'})
-        captured = self.next_capture()
+        if self.span_tracer:
+            self.span_tracer.frame = self.frame_id + 1
+        captured = (
+            self.next_index_capture()
+            if self.text_index
+            else self.next_capture()
+        )
         if captured is None:
             return
         self.captured = captured
-        infos = self.translator.text_kanji_info(self.captured)
+        with stage('lookup', chars=len(self.captured)) as span:
+            infos = self._lookup(self.captured)
+            span['entries'] = len(infos)
         self.infos = infos
-        texts = []
-        # limit generator output to max_entries
-        for info in islice(infos, self.max_entries):
-            kanji = FWS.join(info['kanji'])
-            kana = FWS.join(info['kana'])
-            gloss = '  '.join(info['gloss'])
-            tmp_columns = [
-                make_column(kanji, self.kanji_column),
-                make_column(kana, self.kana_column),
-                make_column(gloss, self.gloss_column)
+        self.frame_id += 1
+        if self.server:
+            self.server.publish({
+                'frame': self.frame_id,
+                'time': time(),
+                'text': self.captured,
+                'entries': infos,
+            })
+        with stage('format'):
+            texts = [
+                self._format_row(info)
+                for info in infos
             ]
-            num_lines = max(
-                c.count('\n') + 1
-                for c in tmp_columns
-            )
-            text = combine_columns(
-                make_column(
-                    kanji,
-                    self.kanji_column,
-                    whitespace=FWS,
-                    num_lines=num_lines
-                ),
-                make_column(
-                    kana,
-                    self.kana_column,
-                    whitespace=FWS,
-                    num_lines=num_lines
-                ),
-                make_column(
-                    gloss,
-                    self.gloss_column,
-                    num_lines=num_lines
-                ),
-                separator='    '
-            )
-            texts.append(text)
         self.text = '\n'.join(texts)
-        if self.clear_tty:
-            clear_tty()
-        else:
-            print()
         self.capture_text = '\n'.join(
             wrap(
                 self.captured,
@@ -524,21 +1043,221 @@ class App:
             wrapped_capture,
             self.text
         ])
-        print(to_print)
+        with stage('print'):
+            self._print(to_print)
         if self.gui:
-            self.update_gui([
-                wrapped_capture,
-                *texts,
-            ])
+            with stage('gui', rows=len(texts)):
+                self.update_gui([
+                    wrapped_capture,
+                    *texts,
+                ])
+
+    def _print(self, text: str):
+        if text == self.printed:
+            return
+        self.printed = text
+        if self.renderer:
+            self.renderer.render(text)
+        else:
+            print()
+            print(text)
+
+    def _format_row(self, info: dict) -> str:
+        key = (
+            tuple(info['kanji']),
+            tuple(info['kana']),
+            tuple(info['gloss']),
+            self.kanji_column,
+            self.kana_column,
+            self.gloss_column,
+        )
+        text = self.row_cache.get(key)
+        if text is None:
+            text = layout_columns(
+                (FWS.join(info['kanji']), self.kanji_column, FWS),
+                (FWS.join(info['kana']), self.kana_column, FWS),
+                ('  '.join(info['gloss']), self.gloss_column, ' '),
+                separator='    '
+            )
+            self.row_cache.put(key, text)
+        return text
 
     def _run(self):
+        if self.recorder:
+            self.recorder.install()
+        if self.span_tracer:
+            self.span_tracer.start()
+        if self.sample_profile:
+            self.sampling_profiler.install_signal()
+            self.sampling_profiler.start()
         self.translator = KanjiTranslator()
+        if self.thread_allocation:
+            log.info({
+                'message': 'Thread allocation',
+                **self.thread_allocation,
+            })
+        if self.ocr_warmup:
+            self.ocr_pool.warmup()
+        if self.serve:
+            self.server = StreamServer(
+                KanjiTranslator,
+                host=self.serve_host,
+                allow_origins=self.serve_origins,
+                **(
+                    {}
+                    if self.serve is True
+                    else {'port': int(self.serve)}
+                ),
+                queue_size=self.serve_queue,
+                max_entries=self.max_entries,
+            )
+            self.server.start()
+        if self.index_area:
+            self.text_index = TextIndex(
+                self._parse_area(self.index_area),
+                self._index_recognize,
+                tile_size=self.index_tile,
+            )
+        if self.prefetch:
+            self.prefetcher = Prefetcher(
+                self._prefetch_capture,
+                interval=self.interval,
+                threshold=self.capture_threshold,
+                steps=self.prefetch_steps,
+            )
+        if self.cpu_target:
+            self.governor = CPUGovernor(
+                self._quality_levels(),
+                self._apply_quality,
+                target=self.cpu_target,
+                window=self.cpu_window,
+            )
         try:
             while True:
+                start = perf_counter()
                 self._loop()
+                self._check_latency(perf_counter() - start)
+                if self.memory_monitor:
+                    self.memory_monitor.tick()
+                if self.governor:
+                    self.governor.tick()
+                    if self.pending_preset:
+                        self._apply_preset()
                 self._wait()
         except KeyboardInterrupt:
             pass
+        finally:
+            self.sampling_profiler.stop()
+            if self.span_tracer:
+                self.span_tracer.stop()
+            log.info({
+                'message': 'OCR metrics',
+                'metrics': self.ocr_pool.metrics(),
+            })
+            self.ocr_pool.close()
+            if self.text_index:
+                log.info({
+                    'message': 'Text index metrics',
+                    'metrics': self.text_index.metrics(),
+                })
+            if self.server:
+                log.info({
+                    'message': 'Stream server metrics',
+                    'metrics': self.server.metrics(),
+                })
+            if self.prefetcher:
+                log.info({
+                    'message': 'Prefetch metrics',
+                    'metrics': self.prefetcher.metrics(),
+                })
+            if self.result_cache:
+                log.info({
+                    'message': 'Result cache metrics',
+                    'metrics': self.result_cache.metrics(),
+                })
+            if self.governor:
+                log.info({
+                    'message': 'CPU governor metrics',
+                    'metrics': self.governor.metrics(),
+                })
+
+    def _check_latency(self, seconds: float):
+        if (
+            self.recorder
+            and self.flight_latency
+            and seconds > self.flight_latency
+        ):
+            self.recorder.dump(
+                'slow_frame',
+                force=False,
+                frame=self.frame_id,
+                seconds=seconds,
+            )
+
+    def _tesseract_engine(self) -> TesseractEngine | None:
+        # Engines in worker processes cannot be switched
+        if self.ocr_processes:
+            return None
+        return first([
+            e for e in self.ocr_engines
+            if isinstance(e, TesseractEngine)
+        ])
+
+    def _quality_levels(self) -> list[dict]:
+        """Settings from the configured quality down to the cheapest."""
+        engine = self._tesseract_engine()
+        levels = [{
+            'scales': self.scales,
+            'divs': self.divs,
+            'tesseract_preset': engine and engine.preset,
+            'interval': self.interval,
+        }]
+
+        def step(**changes):
+            levels.append({**levels[-1], **changes})
+
+        # Without scales the capture is read at every default scale, an auto
+        # scaled capture at a single one
+        if not self.auto_scale:
+            count = self.scales or len(CaptureSet.scales)
+            for scales in range(count - 1, 0, -1):
+                step(scales=scales)
+        # Without divs the capture is read whole, like a single div
+        for divs in range((self.divs or 1) - 1, 0, -1):
+            step(divs=divs)
+        if engine:
+            # Presets are ordered from the fastest
+            presets = list(TESSERACT_PRESETS)
+            for preset in reversed(presets[:presets.index(engine.preset)]):
+                step(tesseract_preset=preset)
+        for factor in [1.5, 2, 3, 4]:
+            step(interval=self.interval * factor)
+        return levels
+
+    def _apply_quality(self, settings: dict):
+        self.scales = settings['scales']
+        self.divs = settings['divs']
+        self.interval = settings['interval']
+        if self.prefetcher:
+            self.prefetcher.interval = self.interval
+        if settings['tesseract_preset']:
+            self.pending_preset = settings['tesseract_preset']
+            self._apply_preset()
+
+    def _apply_preset(self):
+        # A stalled Tesseract call holds the lock, so the preset is switched
+        # on a later frame rather than blocking the capture loop
+        engine = self._tesseract_engine()
+        if not engine:
+            self.pending_preset = None
+            return
+        if not engine.lock.acquire(blocking=False):
+            return
+        try:
+            engine.use_preset(self.pending_preset)
+            self.pending_preset = None
+        finally:
+            engine.lock.release()
 
     def update_gui(self, texts):
         log.debug({
@@ -561,8 +1280,13 @@ class App:
         t = 1.0 / self.fps
         for _ in range((int)(self.interval // t)):
             if self.gui:
-                self.tooltip.update()
-            sleep(t)
+                with stage('gui'):
+                    self.tooltip.update()
+            if self.prefetcher:
+                self.prefetcher.observe(*pyautogui.position())
+                self.prefetcher.schedule(allowed=self._prefetch_allowed)
+            with stage('wait'):
+                sleep(t)
 
     def _print_profile(self):
         print(
@@ -626,19 +1350,88 @@ class App:
         else:
             self._run()
 
+    def bench_preprocess(self, path: str, repeat: int = 3):
+        """
+        Benchmark the preprocessing steps on saved captures.
+
+        Args:
+            path (str): An image file or a directory of images.
+            repeat (int): How many times to run each configuration.
+        """
+        from bench import preprocess_benchmark
+        print('\n'.join(preprocess_benchmark(self, path, repeat=repeat)))
+
+    def bench_presets(self, path: str, repeat: int = 3):
+        """
+        Benchmark the throughput of each Tesseract preset on saved captures.
+
+        Args:
+            path (str): An image file or a directory of images.
+            repeat (int): How many times to run each preset.
+        """
+        from bench import preset_benchmark
+        print('\n'.join(preset_benchmark(
+            path,
+            repeat=repeat,
+            timeout=self.ocr_timeout
+        )))
+
+    def autotune(
+        self,
+        path: str,
+        output: str = 'profile.json',
+        max_latency: float | None = None,
+        eta: int = 3,
+        min_images: int = 2,
+    ):
+        """
+        Find the fastest accurate capture and OCR options for saved captures.
+
+        Capture size, scales, divs, auto scaling and the OCR engine, preset
+        and page segmentation mode are searched with successive halving:
+        all combinations are tried on a few captures and only the best
+        third goes on to more. The Pareto frontier of latency and accuracy
+        is printed, the chosen profile marked with `*` and written to
+        `output`, for `run --config=<output>`.
+
+        Args:
+            path (str): A directory of captures, each with a `.txt` file of
+                the same name holding its text. Captures are cropped around
+                their centre to each capture size.
+            output (str): The JSON file to write the chosen options to.
+            max_latency (float): Choose among the options faster than this
+                many seconds per capture, if any are.
+            eta (int): The reduction factor of every round.
+            min_images (int): The number of captures of the first round.
+        """
+        from autotune import autotune
+        print('\n'.join(autotune(
+            self,
+            path,
+            output=output,
+            max_latency=max_latency,
+            eta=eta,
+            min_images=min_images,
+        )))
+
     @property
     def tooltip(self):
         if not self.gui:
             return None
         if self._tooltip:
             return self._tooltip
-        self._tooltip = Tooltip(font_size=self.font_size)
+        self._tooltip = Tooltip(font_size=self.font_size, avoid=self._region)
         return self._tooltip
 
 
 if __name__ == "__main__":
     commands = Commands()
     commands.create(App, 'run')
+    commands.create(App, 'bench_preprocess')
+    commands.create(App, 'bench_presets')
+    commands.create(App, 'autotune')
+    commands.create(TextGlosser, 'text')
+    commands.create(LookupBenchmark, 'bench_lookup')
     commands.alias('cli', 'run', gui=False)
     commands.alias('gui', 'run', gui=True)
     commands.fire()
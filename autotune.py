@@ -0,0 +1,376 @@
+from PIL import (
+    Image,
+)
+from difflib import SequenceMatcher
+from importlib.util import find_spec
+from itertools import product
+from math import ceil
+from pathlib import Path
+from random import Random
+from time import perf_counter
+from logging import getLogger
+from bench import IMAGE_SUFFIXES
+from ocr import (
+    TESSERACT_PRESETS,
+    TESSERACT_ORIENTATION_PSMS,
+    OCRPool,
+    TesseractEngine,
+    EasyOCREngine,
+)
+import json
+
+log = getLogger('app')
+
+CAPTURE_SIZES = [(120, 76), (160, 100), (240, 150), (320, 200)]
+SCALES = [1, 2, 3]
+DIVS = [None, 1, 2]
+AUTO_SCALE = [False, True]
+
+
+def load_corpus(path: str) -> list[tuple[str, Image.Image, str]]:
+    """
+    Saved captures with their reference text.
+
+    Every image in the directory `path` needs a `.txt` file of the same
+    name holding the text it shows. Images without one are skipped.
+    """
+    path = Path(path)
+    corpus = []
+    for p in sorted(path.iterdir()):
+        if p.suffix.lower() not in IMAGE_SUFFIXES:
+            continue
+        reference = p.with_suffix('.txt')
+        if not reference.exists():
+            log.warning({
+                'message': 'No reference text, skipping capture',
+                'path': str(p),
+            })
+            continue
+        corpus.append((
+            p.name,
+            Image.open(p).convert('RGB'),
+            reference.read_text(encoding='utf-8').strip(),
+        ))
+    if not corpus:
+        raise ValueError(f'No captures with reference text found in {path}')
+    return corpus
+
+
+def accuracy(text: str, reference: str) -> float:
+    """Character similarity of `text` to `reference`, 1.0 is a match."""
+    text = ''.join(text.split())
+    reference = ''.join(reference.split())
+    if not text and not reference:
+        return 1.0
+    return SequenceMatcher(None, reference, text, autojunk=False).ratio()
+
+
+def crop(img: Image, size: tuple[int, int]) -> Image:
+    """The centre of `img` at most `size`, the cursor of a saved capture."""
+    width = min(size[0], img.width)
+    height = min(size[1], img.height)
+    x0 = (img.width - width) // 2
+    y0 = (img.height - height) // 2
+    return img.crop((x0, y0, x0 + width, y0 + height))
+
+
+def engine_options(tesseract: bool = True, easyocr: bool = True) -> list[dict]:
+    """The engine part of the configurations, for the installed engines."""
+    options = []
+    if tesseract and find_spec('pytesseract'):
+        for preset, psm in product(
+            TESSERACT_PRESETS,
+            [None, *TESSERACT_ORIENTATION_PSMS.values()]
+        ):
+            options.append({
+                'tesseract': True,
+                'easyocr': False,
+                'tesseract_preset': preset,
+                'tesseract_psm': psm,
+            })
+    if easyocr and find_spec('easyocr'):
+        options.append({'tesseract': False, 'easyocr': True})
+    return options
+
+
+def configurations(
+    engines: list[dict],
+    max_size: tuple[int, int],
+) -> list[dict]:
+    """Every combination of the swept options, as `App` options."""
+    # Larger captures than the corpus would repeat the largest crop
+    sizes = [
+        s for s in CAPTURE_SIZES
+        if s[0] <= max_size[0] and s[1] <= max_size[1]
+    ] or [max_size]
+    configs = []
+    for engine, size, divs, auto in product(engines, sizes, DIVS, AUTO_SCALE):
+        # The scales ladder is not used with auto_scale
+        for scales in [None] if auto else SCALES:
+            configs.append({
+                'capture_size_x': size[0],
+                'capture_size_y': size[1],
+                'scales': scales,
+                'divs': divs,
+                'auto_scale': auto,
+                **engine,
+            })
+    return configs
+
+
+def describe(config: dict) -> str:
+    engine = (
+        f'tesseract:{config["tesseract_preset"]}'
+        f'/{config["tesseract_psm"] or "auto"}'
+        if config['tesseract']
+        else 'easyocr'
+    )
+    scales = 'auto' if config['auto_scale'] else config['scales']
+    return (
+        f'{config["capture_size_x"]}x{config["capture_size_y"]} '
+        f'scales={scales} divs={config["divs"] or 0} {engine}'
+    )
+
+
+def pareto_front(rows: list[dict]) -> list[dict]:
+    """The rows no other row beats in both latency and accuracy."""
+    front = []
+    for row in sorted(rows, key=lambda r: (r['latency'], -r['accuracy'])):
+        if not front or row['accuracy'] > front[-1]['accuracy']:
+            front.append(row)
+    return front
+
+
+def pareto_ranks(rows: list[dict]) -> list[list[dict]]:
+    """Successive Pareto fronts, the best first."""
+    ranks = []
+    rows = list(rows)
+    while rows:
+        front = pareto_front(rows)
+        ranks.append(front)
+        rows = [r for r in rows if not any(r is f for f in front)]
+    return ranks
+
+
+def choose(
+    front: list[dict],
+    max_latency: float | None = None,
+    tolerance: float = 0.02,
+) -> dict:
+    """
+    The fastest row within `tolerance` of the best accuracy, among the rows
+    under `max_latency` seconds if any are.
+    """
+    rows = [
+        r for r in front
+        if max_latency is None or r['latency'] <= max_latency
+    ] or front[:1]
+    best = max(r['accuracy'] for r in rows)
+    return min(
+        (r for r in rows if r['accuracy'] >= best - tolerance),
+        key=lambda r: r['latency']
+    )
+
+
+class Autotuner:
+    """
+    Search the capture and OCR options for the latency/accuracy frontier.
+
+    The search is successive halving: every configuration is run on
+    `min_images` captures of the corpus, only the best `1 / eta` survive,
+    ranked by Pareto front and then accuracy, and run on `eta` times as many
+    captures, until the survivors have seen the whole corpus. Results of
+    earlier rounds are kept, so a capture is never read twice with the same
+    configuration.
+
+    The captures are read the way `run` reads the screen, with the
+    preprocessing, alternates and timeout of `app`.
+
+    Args:
+        app (App): The app whose pipeline is timed.
+        corpus (list): `(name, image, reference)` from `load_corpus`.
+        configs (list[dict]): The configurations to try.
+        eta (int): The reduction factor of every round.
+        min_images (int): The number of captures of the first round.
+        seed (int): The seed of the corpus shuffle.
+    """
+
+    eta: int = 3
+    min_images: int = 2
+    seed: int = 0
+
+    def __init__(
+        self,
+        app,
+        corpus: list,
+        configs: list[dict],
+        eta: int = eta,
+        min_images: int = min_images,
+        seed: int = seed,
+    ):
+        if eta < 2:
+            raise ValueError(f'eta must be at least 2, got {eta}')
+        self.app = app
+        self.corpus = list(corpus)
+        # A varied prefix makes the early rounds representative
+        Random(seed).shuffle(self.corpus)
+        self.configs = configs
+        self.eta = eta
+        self.min_images = min_images
+        self.pools = {}
+        # describe(config) -> [(latency, accuracy)] in corpus order
+        self.results = {}
+        self.counters = {
+            'rounds': 0,
+            'evaluations': 0,
+        }
+
+    def _pool(self, config: dict) -> OCRPool:
+        key = (
+            config['tesseract_preset'],
+            config['tesseract_psm'],
+        ) if config['tesseract'] else 'easyocr'
+        if key not in self.pools:
+            if config['tesseract']:
+                psm = config['tesseract_psm']
+                engine = TesseractEngine(
+                    preset=config['tesseract_preset'],
+                    psms=[psm] if psm else None,
+                    timeout=self.app.ocr_timeout,
+                )
+            else:
+                engine = EasyOCREngine(timeout=self.app.ocr_timeout)
+            engine.setup()
+            self.pools[key] = OCRPool([engine])
+        return self.pools[key]
+
+    def _read(self, config: dict, img: Image) -> tuple[str, float]:
+        app = self.app
+        app.ocr_pool = self._pool(config)
+        app.scales = config['scales']
+        app.divs = config['divs']
+        app.auto_scale = config['auto_scale']
+        app.text_height = app.ocr_pool.engines[0].preferred_height
+        img = crop(img, (config['capture_size_x'], config['capture_size_y']))
+        start = perf_counter()
+        capture = app._capture_set(img)
+        images = [app._preprocess(i) for i in capture.images()]
+        text = app._read(images, capture.scales, (0, 0, *img.size))
+        return text, perf_counter() - start
+
+    def evaluate(self, config: dict, count: int) -> dict:
+        """Latency and accuracy of `config` on the first `count` captures."""
+        done = self.results.setdefault(describe(config), [])
+        for name, img, reference in self.corpus[len(done):count]:
+            text, latency = self._read(config, img)
+            # The consensus comes first, alternates follow on their own lines
+            best = text.split('\n', 1)[0]
+            done.append((latency, accuracy(best, reference)))
+            self.counters['evaluations'] += 1
+            log.debug({
+                'message': 'Autotune evaluation',
+                'config': describe(config),
+                'capture': name,
+                'text': best,
+                'latency': latency,
+                'accuracy': done[-1][1],
+            })
+        return {
+            'config': config,
+            'name': describe(config),
+            'images': count,
+            'latency': sum(r[0] for r in done) / count,
+            'accuracy': sum(r[1] for r in done) / count,
+        }
+
+    def search(self) -> list[dict]:
+        """Rows of the surviving configurations on the whole corpus."""
+        configs = self.configs
+        count = min(self.min_images, len(self.corpus))
+        while True:
+            self.counters['rounds'] += 1
+            rows = [self.evaluate(c, count) for c in configs]
+            log.info({
+                'message': 'Autotune round',
+                'round': self.counters['rounds'],
+                'configs': len(configs),
+                'images': count,
+            })
+            if count >= len(self.corpus):
+                return rows
+            keep = max(ceil(len(configs) / self.eta), 1)
+            ranked = [
+                row
+                for front in pareto_ranks(rows)
+                for row in sorted(front, key=lambda r: -r['accuracy'])
+            ]
+            configs = [r['config'] for r in ranked[:keep]]
+            count = min(count * self.eta, len(self.corpus))
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+
+
+def autotune(
+    app,
+    path: str,
+    output: str = 'profile.json',
+    max_latency: float | None = None,
+    eta: int = Autotuner.eta,
+    min_images: int = Autotuner.min_images,
+) -> list[str]:
+    """
+    Search the options on a corpus, write the chosen profile to `output`
+    and return the frontier lines.
+    """
+    corpus = load_corpus(path)
+    engines = engine_options()
+    if not engines:
+        raise ImportError('Neither pytesseract nor easyocr is installed')
+    max_size = (
+        max(img.width for _, img, _ in corpus),
+        max(img.height for _, img, _ in corpus),
+    )
+    # Every configuration reads with a pool of its own, the one the app
+    # built from its options is not used
+    app.ocr_pool.close()
+    tuner = Autotuner(
+        app,
+        corpus,
+        configurations(engines, max_size),
+        eta=eta,
+        min_images=min_images,
+    )
+    start = perf_counter()
+    try:
+        rows = tuner.search()
+    finally:
+        tuner.close()
+    front = pareto_front(rows)
+    chosen = choose(front, max_latency)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(chosen['config'], f, indent=2)
+        f.write('\n')
+    log.info({
+        'message': 'Autotune finished',
+        'configs': len(tuner.configs),
+        **tuner.counters,
+        'seconds': perf_counter() - start,
+        'profile': output,
+        'chosen': chosen['name'],
+    })
+
+    def statline(r):
+        cols = [
+            '*' if r is chosen else ' ',
+            f'{r["name"]:48.48}',
+            f'{r["latency"] * 1000:8.2f} ms',
+            f'{r["accuracy"] * 100:6.2f} %',
+        ]
+        return '  '.join(cols)
+
+    return [
+        statline(r)
+        for r in front
+    ]
@@ -0,0 +1,473 @@
+from PIL import (
+    Image,
+)
+from pathlib import Path
+from time import (
+    perf_counter,
+    time,
+)
+from logging import (
+    getLogger,
+    DEBUG,
+    INFO,
+)
+from kanji_translator import KanjiTranslator
+from log import configure_logger
+from preprocess import Preprocessor
+from ocr import (
+    TESSERACT_PRESETS,
+    TesseractEngine,
+    fuse,
+)
+from util import all_substrings
+import json
+import numpy
+import platform
+import tracemalloc
+
+log = getLogger('app')
+
+IMAGE_SUFFIXES = ['.png', '.jpg', '.jpeg', '.bmp', '.webp']
+
+
+def load_images(path: str) -> list[Image.Image]:
+    path = Path(path)
+    paths = (
+        sorted(
+            p for p in path.iterdir()
+            if p.suffix.lower() in IMAGE_SUFFIXES
+        )
+        if path.is_dir()
+        else [path]
+    )
+    if not paths:
+        raise ValueError(f'No images found in {path}')
+    return [Image.open(p).convert('RGB') for p in paths]
+
+
+def timed(func, *args, repeat: int = 1):
+    """Return the result of the last call and the mean time per call."""
+    start = perf_counter()
+    for _ in range(repeat):
+        result = func(*args)
+    return result, (perf_counter() - start) / repeat
+
+
+def preprocess_configs() -> list[tuple[str, Preprocessor | None]]:
+    return [
+        ('raw', None),
+        ('grayscale', Preprocessor(steps=[])),
+        ('+invert', Preprocessor(steps=['invert'])),
+        ('+normalize', Preprocessor(steps=['invert', 'normalize'])),
+        (
+            '+binarize',
+            Preprocessor(steps=['invert', 'normalize', 'binarize'])
+        ),
+        (
+            '+1-bit',
+            Preprocessor(steps=['invert', 'normalize', 'binarize'], bits=1)
+        ),
+    ]
+
+
+def preprocess_benchmark(app, path: str, repeat: int = 3) -> list[str]:
+    """
+    Time each cumulative preprocessing step and the OCR run on its output.
+    """
+    images = load_images(path)
+    rows = []
+    for name, preprocessor in preprocess_configs():
+        prep_time = 0.0
+        ocr_time = 0.0
+        chars = 0
+        for img in images:
+            if preprocessor:
+                img, t = timed(preprocessor, img, repeat=repeat)
+                prep_time += t
+            text, t = timed(app._ocr, img, repeat=repeat)
+            ocr_time += t
+            chars += len(text)
+        rows.append({
+            'name': name,
+            'preprocess': prep_time / len(images),
+            'ocr': ocr_time / len(images),
+            'chars': chars,
+        })
+        log.debug({'message': 'Preprocess benchmark', **rows[-1]})
+    base = rows[0]['preprocess'] + rows[0]['ocr']
+
+    def statline(r):
+        total = r['preprocess'] + r['ocr']
+        cols = [
+            f'{r["name"]:12.12}',
+            f'{r["preprocess"] * 1000:8.2f} ms prep',
+            f'{r["ocr"] * 1000:8.2f} ms ocr',
+            f'{base / total if total else 0:5.2f}x',
+            f'{r["chars"]:6d} chars',
+        ]
+        return '  '.join(cols)
+
+    return [
+        statline(r)
+        for r in rows
+    ]
+
+
+def preset_benchmark(path: str, repeat: int = 3, **kwargs) -> list[str]:
+    """
+    Time Tesseract with each preset and report its throughput.
+    """
+    images = load_images(path)
+    rows = []
+    for preset in TESSERACT_PRESETS:
+        engine = TesseractEngine(preset=preset, **kwargs)
+        engine.setup()
+        total = 0.0
+        chars = 0
+        for img in images:
+            results, t = timed(engine.recognize, img, repeat=repeat)
+            total += t
+            chars += len(fuse(results))
+        rows.append({
+            'name': preset,
+            'time': total / len(images),
+            'chars': chars,
+            'psms': engine.metrics(),
+        })
+        log.debug({'message': 'Preset benchmark', **rows[-1]})
+
+    def statline(r):
+        cols = [
+            f'{r["name"]:12.12}',
+            f'{r["time"] * 1000:8.2f} ms/image',
+            f'{1 / r["time"] if r["time"] else 0:7.2f} images/s',
+            f'{r["chars"]:6d} chars',
+        ]
+        return '  '.join(cols)
+
+    return [
+        statline(r)
+        for r in rows
+    ]
+
+
+LOOKUP_CORPUS = {
+    'ui': [
+        '設定を保存しました',
+        'ファイルを開く',
+        '名前を付けて保存',
+        '接続がタイムアウトしました',
+        '更新プログラムをダウンロード中',
+        '検索結果がありません',
+        'パスワードを入力してください',
+        '通知を有効にする',
+        '言語と地域',
+        '終了',
+    ],
+    'dialogue': [
+        '今日は本当に楽しかったね。',
+        'また明日学校で会おう！',
+        'どうしてそんなことを言ったの？',
+        'お腹が空いたから何か食べに行こうよ。',
+        '彼女は先週東京から引っ越してきたらしい。',
+        '約束を忘れないでください。',
+        '俺はまだ諦めていない。',
+        '雨が降りそうだから傘を持って行って。',
+        '駅前の新しい喫茶店、もう行ってみた？',
+        '明日の会議は午後三時に変更になりました。',
+    ],
+    # Typical OCR mistakes: split words, stray marks, look-alike characters
+    'ocr': [
+        '設定を保存し ました|',
+        'フア イルを開く',
+        '今日は本当に楽しかつたね',
+        '名前を付けて保存l',
+        'ロ本語の勉強',
+        '検索結杲がありません',
+        '彼女は先週東京カら引つ越してきた',
+        '接続がタイムアウト しました。。',
+        '約束を忘れな いでくだ さい',
+        '　明日の会議は午後三時に\n変更になりました',
+    ],
+}
+
+# Allowed ratio to the baseline of metrics where higher is worse
+LOOKUP_THRESHOLDS = {
+    'load_seconds': 1.5,
+    'lookup.all.p50_ms': 1.25,
+    'lookup.all.p90_ms': 1.25,
+    'lookup.all.p99_ms': 1.5,
+    'lookup.all.peak_kb': 1.25,
+    'functions.all_substrings_us': 1.25,
+    'functions.sane_kanji_seq_us': 1.25,
+    'functions.info_sort_key_us': 1.25,
+}
+
+
+def per_call(func, args: list, repeat: int = 5) -> float:
+    """The best mean time in seconds of `func` over every item of `args`."""
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        for a in args:
+            func(*a)
+        t = (perf_counter() - start) / len(args)
+        best = t if best is None else min(best, t)
+    return best
+
+
+def percentiles(times: list[float]) -> dict:
+    p50, p90, p99 = numpy.percentile(times, [50, 90, 99]) * 1000
+    return {
+        'p50_ms': float(p50),
+        'p90_ms': float(p90),
+        'p99_ms': float(p99),
+        'mean_ms': float(numpy.mean(times) * 1000),
+    }
+
+
+def lookup_benchmark(
+    repeat: int = 20,
+    k: int | None = 8,
+    bulk: bool = True,
+    corpus: dict[str, list[str]] = LOOKUP_CORPUS,
+) -> dict:
+    """
+    Measure the dictionary lookup path on a fixed corpus.
+
+    Returns the load time of the dictionary up to its first lookup, the
+    latency percentiles and entries per second of `text_kanji_info` per
+    corpus category and over all of them, its peak traced memory per call,
+    and the time per call of `all_substrings`, `sane_kanji_seq` and
+    `info_sort_key` on the inputs the lookups produce.
+    """
+    # Jamdict opens its database on the first lookup
+    start = perf_counter()
+    translator = KanjiTranslator(bulk)
+    translator.text_kanji_info(corpus[next(iter(corpus))][0], k=k)
+    load = perf_counter() - start
+    lookup = {}
+    every = []
+    found_all = 0
+    entries = {}
+    for category, texts in corpus.items():
+        times = []
+        found = 0
+        for _ in range(repeat):
+            for text in texts:
+                start = perf_counter()
+                infos = translator.text_kanji_info(text, k=k)
+                times.append(perf_counter() - start)
+                found += len(infos)
+                for info in infos:
+                    entries[id(info)] = info
+        lookup[category] = {
+            **percentiles(times),
+            'calls': len(times),
+            'entries_per_second': found / sum(times) if sum(times) else 0.0,
+        }
+        every.extend(times)
+        found_all += found
+    lookup['all'] = {
+        **percentiles(every),
+        'calls': len(every),
+        'entries_per_second': found_all / sum(every) if sum(every) else 0.0,
+    }
+    # Traced separately, tracemalloc slows every allocation down
+    texts = [t for texts in corpus.values() for t in texts]
+    peaks = []
+    tracemalloc.start()
+    try:
+        for text in texts:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            translator.text_kanji_info(text, k=k)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    lookup['all']['peak_kb'] = float(numpy.mean(peaks)) / 1024
+    seqs = [
+        s
+        for text in texts
+        for s in KanjiTranslator.jpn_sequences(text)
+        if s
+    ]
+    candidates = [
+        seq
+        for text in texts
+        for _, seq in translator.ranked_kanji_seqs(text)
+    ]
+    functions = {
+        'all_substrings_us': per_call(
+            all_substrings,
+            [(s, 5) for s in seqs]
+        ),
+        'sane_kanji_seq_us': per_call(
+            KanjiTranslator.sane_kanji_seq,
+            [(s,) for s in candidates]
+        ),
+        'info_sort_key_us': per_call(
+            KanjiTranslator.info_sort_key,
+            [(info,) for info in entries.values()]
+        ),
+    }
+    return {
+        'time': time(),
+        'python': platform.python_version(),
+        'bulk': bulk,
+        'k': k,
+        'repeat': repeat,
+        'corpus': {c: len(t) for c, t in corpus.items()},
+        'load_seconds': load,
+        'lookup': lookup,
+        'functions': {
+            name: t * 1e6
+            for name, t in functions.items()
+        },
+    }
+
+
+def metric(results: dict, name: str) -> float | None:
+    """The value of a dotted metric `name` such as `lookup.all.p50_ms`."""
+    value = results
+    for part in name.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def regressions(
+    results: dict,
+    baseline: dict,
+    thresholds: dict[str, float] = LOOKUP_THRESHOLDS,
+) -> list[str]:
+    """The metrics more than their threshold times worse than `baseline`."""
+    failures = []
+    for name, ratio in thresholds.items():
+        old = metric(baseline, name)
+        new = metric(results, name)
+        if old is None or new is None:
+            continue
+        if new > old * ratio:
+            failures.append(
+                f'{name}: {new:.3f} > {ratio:.2f} x {old:.3f} baseline'
+            )
+    return failures
+
+
+class LookupBenchmark:
+    """
+    Benchmark the dictionary lookup path on a fixed corpus of short UI
+    strings, dialogue and noisy OCR output.
+
+    Results are written as JSON. Given the results of an earlier run as
+    `baseline`, the command fails when a metric got worse by more than its
+    threshold, e.g. `--thresholds='{"lookup.all.p50_ms": 1.1}'`. Thresholds
+    are ratios to the baseline and default to `LOOKUP_THRESHOLDS`.
+
+    Args:
+        repeat (int): How many times to look up every text.
+        max_entries (int): The number of entries per lookup, 0 for all.
+        bulk (bool): Whether to use the bulk lookup.
+        output (str): The JSON file to write the results to.
+        baseline (str): A JSON file of earlier results to compare to.
+        thresholds (dict | str): Allowed ratios to the baseline by metric,
+            as a dict or JSON, merged over the defaults.
+        debug (bool): Whether to enable debug logging.
+        pretty (bool): Whether to use pretty printing for logs.
+    """
+
+    repeat: int = 20
+    max_entries: int = 8
+    bulk: bool = True
+    output: str | None = 'bench-lookup.json'
+    baseline: str | None = None
+    thresholds: dict | str | None = None
+    debug: bool = False
+    pretty: bool = False
+
+    def __init__(
+        self,
+        *args,
+        repeat: int = repeat,
+        max_entries: int = max_entries,
+        bulk: bool = bulk,
+        output: str | None = output,
+        baseline: str | None = baseline,
+        thresholds: dict | str | None = thresholds,
+        debug: bool = debug,
+        pretty: bool = pretty,
+    ):
+        self.repeat = repeat
+        self.max_entries = max_entries
+        self.bulk = bulk
+        self.output = output
+        self.baseline = baseline
+        if isinstance(thresholds, str):
+            thresholds = json.loads(thresholds)
+        self.thresholds = {**LOOKUP_THRESHOLDS, **(thresholds or {})}
+        configure_logger(
+            'app',
+            level=DEBUG if debug else INFO,
+            pretty=pretty
+        )
+
+    def bench_lookup(self):
+        """
+        Benchmark dictionary load, lookups and their helper functions.
+        """
+        baseline = None
+        if self.baseline:
+            if (
+                self.output
+                and Path(self.output).resolve() == Path(self.baseline).resolve()
+            ):
+                raise ValueError(
+                    f'The output {self.output} would overwrite the baseline, '
+                    'pass another --output'
+                )
+            with open(self.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+        results = lookup_benchmark(
+            repeat=self.repeat,
+            k=self.max_entries or None,
+            bulk=self.bulk,
+        )
+        if self.output:
+            with open(self.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+                f.write('\n')
+
+        def statline(name, r):
+            cols = [
+                f'{name:12.12}',
+                f'{r["p50_ms"]:8.3f} ms p50',
+                f'{r["p90_ms"]:8.3f} ms p90',
+                f'{r["p99_ms"]:8.3f} ms p99',
+                f'{r["entries_per_second"]:9.0f} entries/s',
+            ]
+            return '  '.join(cols)
+
+        lines = [
+            f'{"load":12.12}  {results["load_seconds"]:8.3f} s',
+            *(
+                statline(name, r)
+                for name, r in results['lookup'].items()
+            ),
+            f'{"peak":12.12}  {results["lookup"]["all"]["peak_kb"]:8.1f} '
+            'KiB traced per lookup',
+            *(
+                f'{name[:-3]:20.20}  {t:8.3f} us/call'
+                for name, t in results['functions'].items()
+            ),
+        ]
+        print('\n'.join(lines))
+        if baseline is None:
+            return
+        failures = regressions(results, baseline, self.thresholds)
+        if failures:
+            raise SystemExit(
+                'Lookup regressions:\n' + '\n'.join(failures)
+            )
+        print(f'No regressions against {self.baseline}')
@@ -0,0 +1,157 @@
+from PIL import (
+    Image,
+)
+from pathlib import Path
+from hashlib import blake2b
+from typing import Iterable
+from logging import getLogger
+from util import LRUCache
+import json
+import os
+
+log = getLogger('app')
+
+
+def image_key(images: Iterable[Image.Image], config: str = '') -> str:
+    """Content hash of `images` and the configuration that produced them."""
+    h = blake2b(config.encode(), digest_size=20)
+    for img in images:
+        h.update(f'{img.mode}{img.size}'.encode())
+        h.update(img.tobytes())
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    JSON files in a directory, evicting the least recently used files when
+    the total size exceeds `max_bytes`.
+    """
+
+    def __init__(self, path: str | Path, max_bytes: int):
+        self.path = Path(path).expanduser()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.size = sum(
+            p.stat().st_size
+            for p in self.path.glob('*.json')
+        )
+
+    def _file(self, key: str) -> Path:
+        return self.path / f'{key}.json'
+
+    def get(self, key: str):
+        path = self._file(key)
+        try:
+            value = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+        # Mark as recently used for eviction, unless it was just evicted
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key: str, value):
+        path = self._file(key)
+        data = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        tmp = path.with_suffix('.tmp')
+        tmp.write_bytes(data)
+        old_size = path.stat().st_size if path.exists() else 0
+        os.replace(tmp, path)
+        self.size += len(data) - old_size
+        if self.size > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        files = sorted(
+            (p.stat().st_mtime, p.stat().st_size, p)
+            for p in self.path.glob('*.json')
+        )
+        target = self.max_bytes * 0.9
+        size = sum(s for _, s, _ in files)
+        evicted = 0
+        for _, file_size, p in files:
+            if size <= target:
+                break
+            p.unlink(missing_ok=True)
+            size -= file_size
+            evicted += 1
+        self.size = size
+        log.debug({
+            'message': 'Disk cache eviction',
+            'evicted': evicted,
+            'size': size,
+        })
+
+
+class ResultCache:
+    """
+    Two tier cache of OCR text and lookup results, keyed by `image_key`.
+
+    Lookups go to the in-memory LRU first and then to the optional disk
+    tier. Disk hits are promoted to memory.
+
+    Args:
+        entries (int): The number of results kept in memory.
+        path (str | None): Directory of the disk tier, None for memory only.
+        max_mb (float): The size limit of the disk tier in megabytes.
+    """
+
+    entries: int = 256
+    max_mb: float = 64
+
+    def __init__(
+        self,
+        entries: int = entries,
+        path: str | None = None,
+        max_mb: float = max_mb,
+    ):
+        self.memory = LRUCache(entries)
+        self.disk = (
+            DiskCache(path, int(max_mb * 2 ** 20))
+            if path
+            else None
+        )
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+        }
+
+    def get(self, key: str) -> dict | None:
+        value = self.memory.get(key)
+        if value is not None:
+            self.counters['memory_hits'] += 1
+            return value
+        if self.disk:
+            value = self.disk.get(key)
+            if value is not None:
+                self.counters['disk_hits'] += 1
+                self.memory.put(key, value)
+                return value
+        self.counters['misses'] += 1
+        return None
+
+    def put(self, key: str, value: dict):
+        self.memory.put(key, value)
+        if self.disk:
+            try:
+                self.disk.put(key, value)
+            except OSError as e:
+                log.warning({
+                    'message': 'Could not write disk cache',
+                    'error': str(e),
+                })
+
+    def metrics(self) -> dict:
+        c = self.counters
+        total = sum(c.values())
+        return {
+            **c,
+            'hit_rate': (
+                (c['memory_hits'] + c['disk_hits']) / total
+                if total
+                else 0.0
+            ),
+        }
@@ -4,7 +4,9 @@ from inspect import (
     signature
 )
 from logging import getLogger
+from pathlib import Path
 from fire import Fire
+import json
 
 
 log = getLogger()
@@ -67,6 +69,14 @@ def force_pos(p: Parameter):
     )
 
 
+def load_options(path: str) -> dict:
+    """Option values from a JSON file, e.g. written by `autotune`."""
+    options = json.loads(Path(path).expanduser().read_text(encoding='utf-8'))
+    if not isinstance(options, dict):
+        raise ValueError(f'Expected an object of options in {path}')
+    return options
+
+
 class Commands:
 
     commands = {}
@@ -95,7 +105,10 @@ class Commands:
         def _method_kwargs(kwargs):
             return _filter_kwargs(kwargs, [p.name for p in method_kw_params])
 
-        def wrapper(*args, **kwargs):
+        def wrapper(*args, config: str | None = None, **kwargs):
+            # Options given on the command line win over the config file
+            if config:
+                kwargs = {**load_options(config), **kwargs}
             log.trace({
                 'args': args,
                 'kwargs': kwargs,
@@ -118,12 +131,19 @@ class Commands:
                 **_method_kwargs(kwargs)
             )
 
+        config_param = Parameter(
+            name='config',
+            kind=Parameter.KEYWORD_ONLY,
+            default=None,
+            annotation=str | None,
+        )
         wrapper.__name__ = method_name
         wrapper.__signature__ = Signature(
             parameters=[
                 *method_pos_params,
                 *method_kw_params,
                 *class_kw_params,
+                config_param,
             ]
         )
         wrapper.__doc__ = f"{method.__doc__}\n{cls.__doc__}"
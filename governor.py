@@ -0,0 +1,154 @@
+from time import perf_counter
+from typing import Callable
+from logging import getLogger
+import os
+
+log = getLogger('app')
+
+
+def cpu_time() -> float:
+    """
+    CPU seconds used by this process and its child processes, both the
+    running ones and those already waited for, such as Tesseract runs.
+    """
+    try:
+        import psutil
+    except ImportError:
+        # user, system, children_user, children_system
+        return sum(os.times()[:4])
+    process = psutil.Process()
+    times = process.cpu_times()
+    total = (
+        times.user
+        + times.system
+        + getattr(times, 'children_user', 0.0)
+        + getattr(times, 'children_system', 0.0)
+    )
+    for child in process.children(recursive=True):
+        try:
+            total += sum(child.cpu_times()[:2])
+        except psutil.Error:
+            pass
+    return total
+
+
+def system_load() -> float | None:
+    """Machine wide CPU use between 0 and 1, if it can be read."""
+    try:
+        import psutil
+        return psutil.cpu_percent(interval=None) / 100
+    except ImportError:
+        pass
+    if hasattr(os, 'getloadavg'):
+        return min(os.getloadavg()[0] / (os.cpu_count() or 1), 1.0)
+    return None
+
+
+class CPUGovernor:
+    """
+    Keep the CPU use of the process near a target.
+
+    `levels` are settings from best to cheapest quality. Every `window`
+    seconds of `tick` calls the CPU time used in the window is compared to
+    `target`, as a fraction of one core. Above the target the next cheaper
+    level is applied. Below `restore_below` times the target, and while the
+    machine as a whole is under `idle_below` load, the previous level is
+    restored. One step is taken per window, so every step is measured before
+    the next.
+
+    Args:
+        levels (list[dict]): Settings for `apply`, best quality first.
+        apply (Callable): `apply(settings)` switches to a level.
+        target (float): The CPU use to stay under, 0.15 is 15% of a core.
+        window (float): The measurement window in seconds.
+        restore_below (float): Fraction of the target under which quality
+            is restored.
+        idle_below (float): Machine wide load under which quality is
+            restored.
+    """
+
+    target: float = 0.15
+    window: float = 5.0
+    restore_below: float = 0.5
+    idle_below: float = 0.5
+
+    def __init__(
+        self,
+        levels: list[dict],
+        apply: Callable,
+        target: float = target,
+        window: float = window,
+        restore_below: float = restore_below,
+        idle_below: float = idle_below,
+    ):
+        self.levels = levels
+        self.apply = apply
+        self.target = target
+        self.window = window
+        self.restore_below = restore_below
+        self.idle_below = idle_below
+        self.level = 0
+        self.usage = None
+        self.window_start = None
+        self.window_cpu = None
+        self.counters = {
+            'windows': 0,
+            'degrades': 0,
+            'restores': 0,
+            'over_target': 0,
+        }
+
+    def tick(self):
+        now = perf_counter()
+        if self.window_start is None:
+            self.window_start = now
+            self.window_cpu = cpu_time()
+            system_load()
+            return
+        elapsed = now - self.window_start
+        if elapsed < self.window:
+            return
+        cpu = cpu_time()
+        self.usage = max(cpu - self.window_cpu, 0.0) / elapsed
+        self.window_start = now
+        self.window_cpu = cpu
+        self.counters['windows'] += 1
+        load = system_load()
+        if self.usage > self.target:
+            self.counters['over_target'] += 1
+            if self.level + 1 < len(self.levels):
+                self._set_level(self.level + 1, 'degrade', load)
+        elif (
+            self.level > 0
+            and self.usage < self.target * self.restore_below
+            and (load is None or load < self.idle_below)
+        ):
+            self._set_level(self.level - 1, 'restore', load)
+
+    def _set_level(self, level: int, action: str, load: float | None):
+        old = self.levels[self.level]
+        new = self.levels[level]
+        self.level = level
+        self.counters[f'{action}s'] += 1
+        self.apply(new)
+        log.info({
+            'message': 'CPU governor adjustment',
+            'action': action,
+            'usage': self.usage,
+            'target': self.target,
+            'system_load': load,
+            'quality_level': level,
+            'changes': {
+                k: [old[k], v]
+                for k, v in new.items()
+                if old[k] != v
+            },
+        })
+
+    def metrics(self) -> dict:
+        return {
+            **self.counters,
+            'level': self.level,
+            'levels': len(self.levels),
+            'usage': self.usage,
+        }
@@ -1,6 +1,11 @@
 from jamdict import Jamdict
 from jamdict.jmdict import JMDEntry
 import re
+from heapq import (
+    heappush,
+    heappushpop,
+)
+from itertools import count
 from util import (
     all_substrings,
     strings
@@ -8,6 +13,7 @@ from util import (
 from logging import getLogger
 from typing import (
     Iterable,
+    Iterator,
     TypeAlias
 )
 
@@ -19,8 +25,15 @@ KanjiInfos: TypeAlias = Iterable[dict[str, list[str]]]
 
 class KanjiTranslator:
 
-    def __init__(self):
+    # SQLite's default limit of host parameters per statement is 999
+    _max_params = 900
+    bulk: bool = True
+
+    def __init__(self, bulk: bool = bulk):
         self.jam = Jamdict(memory_mode=True)
+        self.bulk = bulk
+        # SQL statements run by the bulk lookups
+        self.queries = 0
 
     _sane_kanji_seq_re = re.compile(r'^([一-龯]+[ぁ-んァ-ン]?)+[ぁ-んァ-ン]?$')
 
@@ -61,6 +74,90 @@ class KanjiTranslator:
             for entry in entries
         ]
 
+    def _select(self, ctx, query: str, params: Iterable) -> list[tuple]:
+        self.queries += 1
+        return ctx.select(query, list(params))
+
+    def _chunks(self, values: list) -> Iterable[list]:
+        for i in range(0, len(values), self._max_params):
+            yield values[i:i + self._max_params]
+
+    def _match_headwords(self, ctx, seqs: list[str]) -> dict[str, list[int]]:
+        matches = {}
+        for chunk in self._chunks(seqs):
+            marks = ','.join('?' * len(chunk))
+            rows = self._select(
+                ctx,
+                f'SELECT text, idseq FROM Kanji WHERE text IN ({marks})'
+                ' UNION'
+                f' SELECT text, idseq FROM Kana WHERE text IN ({marks})',
+                [*chunk, *chunk]
+            )
+            for text, idseq in rows:
+                matches.setdefault(text, []).append(idseq)
+        return matches
+
+    def _hydrate(self, ctx, idseqs: list[int]) -> dict[int, dict]:
+        """
+        Build the `_jdm_entry_to_dict` dicts for `idseqs` straight from the
+        Kanji, Kana and SenseGloss tables instead of hydrating full entries.
+        """
+        infos = {
+            idseq: {'kanji': [], 'kana': [], 'gloss': []}
+            for idseq in idseqs
+        }
+        for chunk in self._chunks(idseqs):
+            marks = ','.join('?' * len(chunk))
+            queries = {
+                'kanji': (
+                    f'SELECT idseq, text FROM Kanji WHERE idseq IN ({marks})'
+                    ' ORDER BY ID'
+                ),
+                'kana': (
+                    f'SELECT idseq, text FROM Kana WHERE idseq IN ({marks})'
+                    ' ORDER BY ID'
+                ),
+                'gloss': (
+                    'SELECT Sense.idseq, SenseGloss.text'
+                    ' FROM Sense JOIN SenseGloss ON SenseGloss.sid = Sense.ID'
+                    f' WHERE Sense.idseq IN ({marks})'
+                    ' ORDER BY Sense.ID, SenseGloss.rowid'
+                ),
+            }
+            for field, query in queries.items():
+                for idseq, text in self._select(ctx, query, chunk):
+                    infos[idseq][field].append(text)
+        return infos
+
+    def lookup_many(self, substrings: Iterable[str]) -> dict[str, KanjiInfos]:
+        """
+        Look up all `substrings` with one set-based query per table.
+
+        Entries reached through several substrings are hydrated once and the
+        same dict is shared between them.
+        """
+        seqs = list(dict.fromkeys(substrings))
+        if not seqs:
+            return {}
+        with self.jam.jmdict.ctx() as ctx:
+            matches = self._match_headwords(ctx, seqs)
+            idseqs = list(dict.fromkeys(
+                idseq
+                for seq_idseqs in matches.values()
+                for idseq in seq_idseqs
+            ))
+            infos = self._hydrate(ctx, idseqs)
+        log.trace({
+            'message': 'Bulk lookup',
+            'substrings': len(seqs),
+            'matched': len(matches),
+            'entries': len(infos),
+        })
+        return {
+            seq: [infos[idseq] for idseq in matches.get(seq, [])]
+            for seq in seqs
+        }
+
     @staticmethod
     def kanji_count(word: str) -> int:
         return len(
@@ -72,37 +169,100 @@ class KanjiTranslator:
         )
 
     @staticmethod
-    def info_sort_key(info: dict) -> int:
+    def seq_sort_key(seq: str) -> tuple[int, int]:
+        return (KanjiTranslator.kanji_count(seq), len(seq))
+
+    @staticmethod
+    def info_sort_key(info: dict) -> tuple[int, int]:
         num_kanji = max(
-            KanjiTranslator.kanji_count(k)
-            for k in info['kanji']
+            (
+                KanjiTranslator.kanji_count(k)
+                for k in info['kanji']
+            ),
+            default=0
         )
         num_chars = max(
-            len(k)
-            for k in info['kanji']
+            (
+                len(k)
+                for k in info['kanji']
+            ),
+            default=0
         )
         return (num_kanji, num_chars)
 
+    def ranked_kanji_seqs(self, text: str) -> Iterator[tuple[tuple, str]]:
+        """
+        Yield the lookup candidates of `text` as `(seq_sort_key, seq)` in
+        descending key order, i.e. the substrings with most kanji and most
+        characters first.
+        """
+        buckets = {}
+        for jpn_seq in self.jpn_sequences(text):
+            for seq in all_substrings(jpn_seq, 5):
+                key = self.seq_sort_key(seq)
+                buckets.setdefault(key, set()).add(seq)
+        for key in sorted(buckets, reverse=True):
+            for seq in sorted(buckets[key]):
+                if self.sane_kanji_seq(seq):
+                    yield key, seq
+
+    def text_kanji_info(self, text: str, k: int | None = None) -> KanjiInfos:
+        """
+        Look up the dictionary entries for the kanji sequences in `text`.
 
-    def text_kanji_info(self, text):
-        log.debug({'text': text})
-        jpn_seqs = self.jpn_sequences(text)
-        seqs = set([
-            seq
-            for jpn_seq in jpn_seqs
-            for seq in all_substrings(jpn_seq, 5)
-        ])
-        kanji_seqs = [s for s in seqs if self.sane_kanji_seq(s)]
-        log.trace({'kanji_seqs': kanji_seqs})
-        infos = [
+        Entries are ranked by the key of the substring they were found with
+        and then by their own `info_sort_key`. If `k` is given, only the `k`
+        best entries are returned and the lookups stop as soon as no
+        remaining candidate can beat the current `k`-th best entry.
+
+        With `bulk` (the default) all candidates are resolved up front with
+        `lookup_many`, otherwise each candidate is looked up on its own.
+        """
+        log.debug({'text': text, 'k': k})
+        candidates = self.ranked_kanji_seqs(text)
+        queries = self.queries
+        if self.bulk:
+            candidates = list(candidates)
+            found = self.lookup_many(seq for _, seq in candidates)
+            lookup = found.__getitem__
+        else:
+            lookup = self.kanji_info
+        best = []
+        seen = set()
+        tiebreak = count()
+        lookups = 0
+        for seq_key, seq in candidates:
+            if k is not None and len(best) >= k and seq_key < best[0][0][0]:
+                break
+            # Bulk lookups were all done up front, their queries are counted
+            if not self.bulk:
+                lookups += 1
+            for info in lookup(seq):
+                # Bulk lookups share the dict of an entry between substrings,
+                # the first (best ranked) substring wins. `found` keeps those
+                # dicts alive, so their ids are not reused; separate lookups
+                # return fresh dicts that may be freed and are not deduped.
+                if self.bulk:
+                    if id(info) in seen:
+                        continue
+                    seen.add(id(info))
+                # Sort key is computed once per entry and kept in the heap
+                item = (
+                    (seq_key, self.info_sort_key(info)),
+                    -next(tiebreak),
+                    info
+                )
+                if k is None or len(best) < k:
+                    heappush(best, item)
+                else:
+                    heappushpop(best, item)
+        sorted_infos = [
             info
-            for kanji in kanji_seqs
-            for info in self.kanji_info(kanji)
+            for _, _, info in sorted(best, reverse=True)
         ]
-        sorted_infos = sorted(
-            infos,
-            key=self.info_sort_key,
-            reverse=True
-        )
-        log.trace({'sorted_infos': sorted_infos})
+        log.trace({
+            'lookups': lookups,
+            'queries': self.queries - queries,
+            'sorted_infos': sorted_infos,
+        })
         return sorted_infos
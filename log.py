@@ -2,9 +2,20 @@
 from logging import (
     getLogger,
     Formatter,
+    Handler,
     StreamHandler,
     INFO,
+    addLevelName,
 )
+from collections import deque
+from pathlib import Path
+from time import (
+    time,
+    strftime,
+    localtime,
+)
+import threading
+import signal
 import json
 import sys
 from colorama import (
@@ -13,6 +24,7 @@ from colorama import (
 )
 
 TRACE = 5
+addLevelName(TRACE, 'TRACE')
 
 
 class JSONFormatter(Formatter):
@@ -68,15 +80,141 @@ class JSONFormatter(Formatter):
         return record.message
 
 
-def configure_logger(name=None, level=INFO, pretty=False):
+class FlightRecorder(Handler):
+    """
+    Keep the last `capacity` records in memory and write them out on demand.
+
+    Records are stored as tuples of their raw fields, without formatting or
+    locking, so that trace logging can stay on all the time. `dump` writes
+    them as JSON lines to `{prefix}-{time}-{n}.jsonl`; it is called on
+    `signum` (SIGUSR2 by default) once `install` ran, on uncaught exceptions
+    and by the application, e.g. on slow frames. Dumps closer together than
+    `min_interval` seconds are skipped, except on demand.
+    """
+
+    capacity: int = 10000
+    prefix: str = 'flight'
+    min_interval: float = 10.0
+
+    def __init__(
+        self,
+        capacity: int = capacity,
+        prefix: str = prefix,
+        min_interval: float = min_interval,
+        level: int = TRACE,
+    ):
+        super().__init__(level)
+        self.records = deque(maxlen=capacity)
+        self.prefix = prefix
+        self.min_interval = min_interval
+        self.dumps = 0
+        self.last_dump = 0.0
+
+    def handle(self, record):
+        # Overrides Handler.handle to skip the lock, deque.append is atomic.
+        # `log.trace` calls `_log` directly, so the level is checked here.
+        if record.levelno < self.level:
+            return False
+        self.records.append((
+            record.created,
+            record.levelname,
+            record.threadName,
+            record.filename,
+            record.lineno,
+            record.funcName,
+            record.msg,
+            record.args,
+        ))
+        return True
+
+    def emit(self, record):
+        self.handle(record)
+
+    @staticmethod
+    def _message(entry) -> dict:
+        created, level, thread, filename, lineno, func, msg, args = entry
+        if isinstance(msg, dict) and callable(msg.get('lazy')):
+            msg = msg['lazy']
+        message = {
+            'timestamp': strftime('%Y-%m-%d %H:%M:%S', localtime(created))
+            + f',{int(created * 1000) % 1000:03d}',
+            'level': level,
+            'thread': thread,
+            'filename': filename,
+            'lineno': lineno,
+            'funcName': func,
+        }
+        if isinstance(msg, dict):
+            message.update(msg)
+        else:
+            message['message'] = str(msg) % args if args else str(msg)
+        return message
+
+    def dump(self, reason: str = 'manual', force: bool = True, **details):
+        """Write the recorded records to a new file, return its path."""
+        now = time()
+        if not force and now - self.last_dump < self.min_interval:
+            return None
+        self.last_dump = now
+        entries = list(self.records)
+        path = Path(f'{self.prefix}-{int(now)}-{self.dumps}.jsonl')
+        self.dumps += 1
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(
+                {'reason': reason, 'records': len(entries), **details},
+                default=str
+            ))
+            f.write('\n')
+            for entry in entries:
+                f.write(json.dumps(self._message(entry), default=str))
+                f.write('\n')
+        getLogger('app').warning({
+            'message': 'Flight recorder dumped',
+            'reason': reason,
+            'path': str(path),
+            'records': len(entries),
+        })
+        return path
+
+    def install(self, signum=None):
+        """Dump on `signum` and on uncaught exceptions in any thread."""
+        signum = signum or getattr(signal, 'SIGUSR2', None)
+        if signum is not None:
+            signal.signal(signum, lambda *_: self.dump('signal'))
+        excepthook = sys.excepthook
+        thread_excepthook = threading.excepthook
+
+        def on_exception(*args):
+            self.dump('exception', error=repr(args[1]))
+            excepthook(*args)
+
+        def on_thread_exception(args):
+            self.dump(
+                'exception',
+                error=repr(args.exc_value),
+                thread=args.thread and args.thread.name
+            )
+            thread_excepthook(args)
+
+        sys.excepthook = on_exception
+        threading.excepthook = on_thread_exception
+
+
+def configure_logger(name=None, level=INFO, pretty=False, recorder=None):
     log = getLogger(name) if name else getLogger()
     log.setLevel(level)
     handler = StreamHandler(stream=sys.stderr)
     handler.setLevel(level)
     handler.setFormatter(JSONFormatter(pretty=pretty))
     log.addHandler(handler)
+    if recorder:
+        # Let records below `level` through to the recorder only
+        log.setLevel(min(level, recorder.level))
+        log.addHandler(recorder)
 
     def trace(msg, *args, **kwargs):
+        # Report the caller, not this function
+        kwargs.setdefault('stacklevel', 2)
         log._log(TRACE, msg, args, **kwargs)
     log.trace = trace
 
@@ -0,0 +1,153 @@
+from logging import getLogger
+from pathlib import Path
+from collections import deque
+import tracemalloc
+import os
+
+log = getLogger('app')
+
+
+def rss() -> int | None:
+    """Resident set size of this process in bytes, if it can be read."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    statm = Path('/proc/self/statm')
+    if statm.exists():
+        pages = int(statm.read_text().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    return None
+
+
+class MemoryMonitor:
+    """
+    Track memory growth with `tracemalloc`.
+
+    Call `tick` once per loop. Every `every` ticks a snapshot is taken and
+    the allocation sites that grew the most since the first snapshot are
+    logged together with the traced and resident memory. Can also be used
+    as a context manager around a piece of code, followed by
+    `assert_budget` to check how much it grew.
+
+    Args:
+        every (int): Take a snapshot every this many ticks.
+        top (int): The number of allocation sites to report.
+        frames (int): The number of stack frames to keep per allocation.
+    """
+
+    every: int = 100
+    top: int = 10
+    frames: int = 1
+    # Reports kept for the RSS trend
+    history_size: int = 10
+
+    def __init__(
+        self,
+        every: int = every,
+        top: int = top,
+        frames: int = frames,
+    ):
+        self.every = every
+        self.top = top
+        self.frames = frames
+        self.ticks = 0
+        self.baseline = None
+        self.baseline_traced = 0
+        self.baseline_rss = None
+        self.history = deque(maxlen=self.history_size)
+        self.final_traced = None
+        self._started = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started = True
+        # Read RSS first, the first call may import psutil
+        self.baseline_rss = rss()
+        self.baseline = self._snapshot()
+        self.baseline_traced = tracemalloc.get_traced_memory()[0]
+
+    def stop(self):
+        if self._started:
+            self.final_traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            self._started = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.report()
+        self.stop()
+
+    @staticmethod
+    def _snapshot():
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+
+    def tick(self):
+        if self.baseline is None:
+            self.start()
+        self.ticks += 1
+        if self.ticks % self.every == 0:
+            self.report()
+
+    def growth(self) -> int:
+        """Traced memory growth in bytes since `start`."""
+        traced = (
+            tracemalloc.get_traced_memory()[0]
+            if tracemalloc.is_tracing()
+            else self.final_traced or 0
+        )
+        return traced - self.baseline_traced
+
+    def report(self) -> dict:
+        snapshot = self._snapshot()
+        stats = snapshot.compare_to(self.baseline, 'lineno')
+        traced, peak = tracemalloc.get_traced_memory()
+        current_rss = rss()
+        report = {
+            'ticks': self.ticks,
+            'traced': traced,
+            'traced_growth': traced - self.baseline_traced,
+            'traced_peak': peak,
+            'rss': current_rss,
+            'rss_growth': (
+                current_rss - self.baseline_rss
+                if current_rss is not None and self.baseline_rss is not None
+                else None
+            ),
+            'top_growth': [
+                {
+                    'site': str(stat.traceback),
+                    'size_diff': stat.size_diff,
+                    'count_diff': stat.count_diff,
+                    'size': stat.size,
+                }
+                for stat in [s for s in stats if s.size_diff > 0][:self.top]
+            ],
+        }
+        self.history.append({
+            k: report[k]
+            for k in ['ticks', 'traced', 'rss']
+        })
+        log.info({
+            'message': 'Memory report',
+            **report,
+            'rss_trend': [h['rss'] for h in self.history],
+        })
+        return report
+
+    def within_budget(self, budget: int) -> bool:
+        return self.growth() <= budget
+
+    def assert_budget(self, budget: int):
+        growth = self.growth()
+        assert growth <= budget, (
+            f'Traced memory grew by {growth} bytes, budget {budget} bytes'
+        )
@@ -0,0 +1,902 @@
+from PIL import (
+    Image,
+)
+from abc import (
+    ABC,
+    abstractmethod,
+)
+from pathlib import Path
+from threading import Lock
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    TimeoutError,
+    wait,
+)
+from difflib import SequenceMatcher
+from time import perf_counter
+from typing import (
+    Iterable,
+    NamedTuple,
+)
+from logging import getLogger
+from profiler import stage
+from preprocess import text_orientation
+from util import (
+    first,
+    on_windows,
+    LRUCache,
+)
+import os
+import re
+import numpy
+
+log = getLogger('app')
+
+TESSERACT_SEARCH_PATHS = [
+    Path(r'C:\Program Files\Tesseract-OCR\tesseract.exe'),
+    Path(r'C:\Program Files (x86)\Tesseract-OCR\tesseract.exe'),
+]
+
+if 'TESSERACT_PATH' in os.environ:
+    TESSERACT_SEARCH_PATHS.append(Path(
+        os.environ['TESSERACT_PATH']
+    ))
+    TESSERACT_SEARCH_PATHS.append(
+        Path(os.environ['TESSERACT_PATH']) / 'tesseract.exe'
+    )
+
+# Directories of the tessdata_fast and tessdata_best models, used by the
+# presets. The installed traineddata is used when they are not set.
+TESSDATA_DIRS = {
+    'fast': os.environ.get('TESSDATA_FAST_PREFIX'),
+    'best': os.environ.get('TESSDATA_BEST_PREFIX'),
+}
+
+# psms None picks the page segmentation mode from the text orientation
+TESSERACT_PRESETS = {
+    'fast': {'oem': 1, 'tessdata': 'fast', 'dpi': 70, 'psms': None},
+    'balanced': {'oem': 3, 'tessdata': None, 'dpi': 96, 'psms': None},
+    'accurate': {'oem': 1, 'tessdata': 'best', 'dpi': 300, 'psms': [5, 6]},
+}
+
+TESSERACT_ORIENTATION_PSMS = {
+    'vertical': 5,
+    'horizontal': 6,
+}
+
+
+class OCRResult:
+
+    def __init__(
+        self,
+        text: str,
+        confidence: float,
+        engine: str = ''
+    ):
+        self.text = text
+        self.confidence = confidence
+        self.engine = engine
+
+    def __repr__(self):
+        return f'OCRResult({self.text!r}, {self.confidence:.2f}, {self.engine})'
+
+
+class TextBox:
+
+    def __init__(
+        self,
+        x0: int,
+        y0: int,
+        x1: int,
+        y1: int,
+        text: str,
+        confidence: float = 1.0
+    ):
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+        self.text = text
+        self.confidence = confidence
+
+    def moved(self, dx: int, dy: int) -> 'TextBox':
+        return TextBox(
+            self.x0 + dx,
+            self.y0 + dy,
+            self.x1 + dx,
+            self.y1 + dy,
+            self.text,
+            self.confidence
+        )
+
+    def intersects(self, x0: int, y0: int, x1: int, y1: int) -> bool:
+        return self.x0 < x1 and x0 < self.x1 and self.y0 < y1 and y0 < self.y1
+
+    def __repr__(self):
+        return (
+            f'TextBox(({self.x0}, {self.y0}, {self.x1}, {self.y1}), '
+            f'{self.text!r})'
+        )
+
+
+class AreaKey(NamedTuple):
+    """
+    Identifies an image by the screen area it was taken in.
+
+    `area` is a coarse, hashable screen area and `index` tells the images
+    of one capture apart. `origin` is the top left corner of the image
+    relative to the area, in image pixels, so engines can reuse work done
+    on an earlier image of the same area that was taken a bit off.
+    """
+
+    area: tuple
+    index: tuple
+    origin: tuple[float, float]
+
+
+class OCREngine(ABC):
+    """
+    Base class for OCR engines.
+
+    `recognize` returns one or more alternative readings of the whole image,
+    each with a confidence between 0 and 1. `key` identifies the screen area
+    the image was taken from, engines may use it to reuse earlier work.
+    """
+
+    name: str = ''
+    timeout: float = 10.0
+    # Text height in pixels the engine reads best
+    preferred_height: int = 32
+    # Attributes not sent to worker processes, which set engines up again
+    transient: tuple = ('lock',)
+    # CPU threads the engine computes with, None for the library default
+    threads: int | None = None
+    interop_threads: int | None = None
+
+    def __init__(self, timeout: float = timeout):
+        self.timeout = timeout
+        # Engines may be shared by the capture loop and background workers
+        self.lock = Lock()
+
+    def __getstate__(self):
+        return {
+            k: v
+            for k, v in self.__dict__.items()
+            if k not in self.transient
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+    def setup(self):
+        pass
+
+    def use_threads(self, threads: int, interop_threads: int | None = None):
+        """
+        Limit the CPU threads of the engine. Engines apply the limit now if
+        they are set up, and in `setup` otherwise.
+        """
+        self.threads = threads
+        self.interop_threads = interop_threads
+
+    def warmup(self):
+        self.recognize(Image.new('L', (64, 32), 255))
+
+    @abstractmethod
+    def recognize(self, img: Image, key=None) -> list[OCRResult]:
+        pass
+
+    @abstractmethod
+    def recognize_boxes(self, img: Image) -> list[TextBox]:
+        """Recognise text lines with their positions in `img`."""
+
+    def metrics(self) -> dict:
+        return {}
+
+
+class TesseractEngine(OCREngine):
+    """
+    Tesseract engine.
+
+    A preset from `TESSERACT_PRESETS` chooses the OCR engine mode, the
+    traineddata variant, the DPI hint and the page segmentation modes.
+    Presets without fixed `psms` run a single pass, with the mode matching
+    the orientation of the text in the image.
+    """
+
+    name = 'tesseract'
+    pytesseract = None
+    transient = ('lock', 'pytesseract')
+    preset: str = 'balanced'
+    psms: Iterable[int] | None = None
+
+    def __init__(
+        self,
+        preset: str = preset,
+        psms: Iterable[int] | None = psms,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.fixed_psms = psms
+        self.counters = {psm: 0 for psm in TESSERACT_ORIENTATION_PSMS.values()}
+        self.use_preset(preset)
+
+    def use_preset(self, preset: str):
+        if preset not in TESSERACT_PRESETS:
+            raise ValueError(
+                f'Unknown Tesseract preset: {preset}, '
+                f'expected one of {list(TESSERACT_PRESETS)}'
+            )
+        self.preset = preset
+        settings = TESSERACT_PRESETS[preset]
+        self.psms = self.fixed_psms or settings['psms']
+        self.oem = settings['oem']
+        self.dpi = settings['dpi']
+        self.tessdata_dir = TESSDATA_DIRS.get(settings['tessdata'])
+
+    def setup(self):
+        import pytesseract
+        self.pytesseract = pytesseract
+        tesseract_exe = first([
+            p for p in TESSERACT_SEARCH_PATHS
+            if p.exists() and p.is_file()
+        ])
+        if on_windows():
+            self.pytesseract.pytesseract.tesseract_cmd = str(tesseract_exe)
+        self._limit_threads()
+        tessdata = TESSERACT_PRESETS[self.preset]['tessdata']
+        if tessdata and not self.tessdata_dir:
+            log.warning({
+                'message': 'Tessdata directory not set, using installed data',
+                'preset': self.preset,
+                'variable': f'TESSDATA_{tessdata.upper()}_PREFIX',
+            })
+
+    def use_threads(self, threads: int, interop_threads: int | None = None):
+        super().use_threads(threads, interop_threads)
+        if self.pytesseract:
+            self._limit_threads()
+
+    def _limit_threads(self):
+        # Tesseract runs as a subprocess, which inherits the environment.
+        # OpenMP reads the variable when it loads, so the limit does not
+        # reach a torch already imported by this process.
+        if self.threads:
+            os.environ['OMP_THREAD_LIMIT'] = str(self.threads)
+
+    def _config(self, psm: int) -> str:
+        config = f'--psm {psm} --oem {self.oem} --dpi {self.dpi}'
+        if self.tessdata_dir:
+            config += f' --tessdata-dir "{self.tessdata_dir}"'
+        return config
+
+    def select_psms(self, img: Image) -> list[int]:
+        if self.psms:
+            return list(self.psms)
+        psm = TESSERACT_ORIENTATION_PSMS[text_orientation(img)]
+        self.counters[psm] += 1
+        return [psm]
+
+    def _recognize_psm(self, img: Image, psm: int) -> OCRResult:
+        data = self.pytesseract.image_to_data(
+            img,
+            lang='jpn',
+            config=self._config(psm),
+            output_type=self.pytesseract.Output.DICT
+        )
+        words = [
+            (text, float(conf))
+            for text, conf in zip(data['text'], data['conf'])
+            if float(conf) >= 0 and text.strip()
+        ]
+        text = ''.join(w for w, _ in words)
+        confidence = (
+            sum(len(w) * c for w, c in words) / len(text) / 100
+            if text
+            else 0.0
+        )
+        return OCRResult(text, confidence, f'{self.name}:psm{psm}')
+
+    def recognize_boxes(self, img: Image) -> list[TextBox]:
+        if not self.pytesseract:
+            self.setup()
+        data = self.pytesseract.image_to_data(
+            img,
+            lang='jpn',
+            config=self._config(3),
+            output_type=self.pytesseract.Output.DICT
+        )
+        lines = {}
+        for i, text in enumerate(data['text']):
+            if float(data['conf'][i]) < 0 or not text.strip():
+                continue
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            x0, y0 = data['left'][i], data['top'][i]
+            x1, y1 = x0 + data['width'][i], y0 + data['height'][i]
+            conf = float(data['conf'][i]) / 100
+            if key in lines:
+                box = lines[key]
+                box.x0, box.y0 = min(box.x0, x0), min(box.y0, y0)
+                box.x1, box.y1 = max(box.x1, x1), max(box.y1, y1)
+                box.text += text
+                box.confidence = min(box.confidence, conf)
+            else:
+                lines[key] = TextBox(x0, y0, x1, y1, text, conf)
+        return list(lines.values())
+
+    def recognize(self, img: Image, key=None) -> list[OCRResult]:
+        log.debug({
+            'message': 'Running Tesseract',
+            'img.size': img.size,
+        })
+        if not self.pytesseract:
+            self.setup()
+        return [
+            self._recognize_psm(img, psm)
+            for psm in self.select_psms(img)
+        ]
+
+    def metrics(self) -> dict:
+        return {
+            'preset': self.preset,
+            **{
+                f'psm{psm}': count
+                for psm, count in self.counters.items()
+            },
+        }
+
+
+class EasyOCREngine(OCREngine):
+    """
+    EasyOCR engine.
+
+    With `reuse_detection`, the text boxes found by the detector are cached
+    per `key` and later images of the same area only re-run the recogniser
+    on the boxes whose pixels changed. With an `AreaKey`, captures that
+    moved within the area reuse the boxes too, shifted by the difference of
+    their origins. Detection runs again when pixels change outside the
+    known boxes, i.e. when the layout shifts or new text comes into view.
+    """
+
+    name = 'easyocr'
+    preferred_height = 40
+    reader = None
+    transient = ('lock', 'reader')
+    reuse_detection: bool = False
+    # Mean absolute grey level difference for a box to count as changed
+    box_threshold: float = 2.0
+    # Fraction of changed pixels outside the boxes that triggers detection
+    layout_threshold: float = 0.005
+    cache_size: int = 64
+
+    def __init__(
+        self,
+        reuse_detection: bool = reuse_detection,
+        cache_size: int = cache_size,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.reuse_detection = reuse_detection
+        self.layouts = LRUCache(cache_size)
+        self.counters = {
+            'frames': 0,
+            'detections': 0,
+            'boxes_reused': 0,
+            'boxes_recognized': 0,
+        }
+
+    def setup(self):
+        from easyocr import Reader
+        self.reader = Reader(['ja'])
+        self._limit_threads()
+
+    def use_threads(self, threads: int, interop_threads: int | None = None):
+        super().use_threads(threads, interop_threads)
+        if self.reader:
+            self._limit_threads()
+
+    def _limit_threads(self):
+        if not self.threads:
+            return
+        import torch
+        torch.set_num_threads(self.threads)
+        if self.interop_threads:
+            try:
+                torch.set_num_interop_threads(self.interop_threads)
+            except RuntimeError as e:
+                # Only possible before torch ran anything in parallel
+                log.debug({
+                    'message': 'torch inter-op threads not set',
+                    'error': str(e),
+                })
+
+    @staticmethod
+    def _bounds(kind: str, box) -> tuple[float, float, float, float]:
+        """`(x0, y0, x1, y1)` of a horizontal (`h`) or free (`f`) box."""
+        if kind == 'h':
+            x0, x1, y0, y1 = box
+            return x0, y0, x1, y1
+        xs = [p[0] for p in box]
+        ys = [p[1] for p in box]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    @staticmethod
+    def _moved(kind: str, box, dx: float, dy: float, width: int, height: int):
+        """The box moved by `dx, dy` and clipped to the image."""
+        if kind == 'h':
+            x0, x1, y0, y1 = box
+            return [
+                int(min(max(x0 + dx, 0), width)),
+                int(min(max(x1 + dx, 0), width)),
+                int(min(max(y0 + dy, 0), height)),
+                int(min(max(y1 + dy, 0), height)),
+            ]
+        return [
+            [
+                int(min(max(x + dx, 0), width)),
+                int(min(max(y + dy, 0), height)),
+            ]
+            for x, y in box
+        ]
+
+    @staticmethod
+    def _rect(bounds: tuple, width: int, height: int) -> tuple[slice, slice]:
+        x0, y0, x1, y1 = bounds
+        return (
+            slice(max(int(y0), 0), min(int(y1) + 1, height)),
+            slice(max(int(x0), 0), min(int(x1) + 1, width)),
+        )
+
+    def _recognize_boxes(self, grey: numpy.ndarray, boxes: list) -> list:
+        """
+        Recognise `(kind, box)` boxes and return the result of each box, or
+        None. Results are matched to boxes by overlap, as the recogniser
+        does not keep the order of its input with batches.
+        """
+        if not boxes:
+            return []
+        results = self.reader.recognize(
+            grey,
+            horizontal_list=[b for k, b in boxes if k == 'h'],
+            free_list=[b for k, b in boxes if k == 'f'],
+        )
+        bounds = [self._bounds(k, b) for k, b in boxes]
+        matched = [None] * len(boxes)
+        for result in results:
+            rx0, ry0, rx1, ry1 = self._bounds('f', result[0])
+            best = None
+            best_area = 0.0
+            for i, (x0, y0, x1, y1) in enumerate(bounds):
+                if matched[i] is not None:
+                    continue
+                area = (
+                    max(min(x1, rx1) - max(x0, rx0), 0)
+                    * max(min(y1, ry1) - max(y0, ry0), 0)
+                )
+                if area > best_area:
+                    best, best_area = i, area
+            if best is not None:
+                matched[best] = result
+        return matched
+
+    def _detect(self, grey: numpy.ndarray, cache_key, origin) -> list:
+        horizontal, free = self.reader.detect(grey)
+        boxes = [
+            *(('h', b) for b in horizontal[0]),
+            *(('f', b) for b in free[0]),
+        ]
+        results = self._recognize_boxes(grey, boxes)
+        self.counters['detections'] += 1
+        self.counters['boxes_recognized'] += len(boxes)
+        if cache_key is not None:
+            self.layouts.put(cache_key, {
+                'grey': grey,
+                'origin': origin,
+                'boxes': boxes,
+                'results': results,
+            })
+        return [r for r in results if r is not None]
+
+    def _reuse(
+        self,
+        grey: numpy.ndarray,
+        layout: dict,
+        cache_key,
+        origin: tuple[float, float],
+    ) -> list | None:
+        """
+        Results from the cached layout of the same area, moved by the
+        difference of the image origins. Boxes that changed, or that moved
+        onto the image border, are recognised again. Returns None when the
+        layout itself changed, which needs a new detection.
+        """
+        height, width = grey.shape
+        dx = round(layout['origin'][0] - origin[0])
+        dy = round(layout['origin'][1] - origin[1])
+        if abs(dx) >= width or abs(dy) >= height:
+            return None
+        # Pixel (x, y) of this image was at (x - dx, y - dy) in the cached one
+        ys = slice(max(dy, 0), min(height + dy, height))
+        xs = slice(max(dx, 0), min(width + dx, width))
+        cached = layout['grey'][
+            ys.start - dy:ys.stop - dy,
+            xs.start - dx:xs.stop - dx
+        ]
+        diff = numpy.full(grey.shape, 255, dtype=numpy.int16)
+        diff[ys, xs] = numpy.abs(
+            grey[ys, xs].astype(numpy.int16) - cached.astype(numpy.int16)
+        )
+        known = numpy.zeros(grey.shape, dtype=bool)
+        known[ys, xs] = True
+        # New pixels count as changed only where they differ from background
+        background = numpy.median(grey)
+        diff[~known] = numpy.abs(
+            grey[~known].astype(numpy.int16) - int(background)
+        )
+        outside = numpy.ones(grey.shape, dtype=bool)
+        boxes = []
+        results = []
+        changed = []
+        for (kind, box), result in zip(layout['boxes'], layout['results']):
+            x0, y0, x1, y1 = self._bounds(kind, box)
+            if (
+                x1 + dx <= 0 or y1 + dy <= 0
+                or x0 + dx >= width or y0 + dy >= height
+            ):
+                # Moved out of the image
+                continue
+            moved = self._moved(kind, box, dx, dy, width, height)
+            rect = self._rect(self._bounds(kind, moved), width, height)
+            outside[rect] = False
+            cut = (
+                x0 + dx < 0 or y0 + dy < 0
+                or x1 + dx > width or y1 + dy > height
+            )
+            if (
+                cut
+                or result is None
+                or not known[rect].all()
+                or (diff[rect].size and diff[rect].mean() > self.box_threshold)
+            ):
+                changed.append(len(boxes))
+                result = None
+            else:
+                result = (
+                    self._moved('f', result[0], dx, dy, width, height),
+                    *result[1:]
+                )
+            boxes.append((kind, moved))
+            results.append(result)
+        outside_changed = diff[outside] > 32
+        if (
+            outside_changed.size
+            and outside_changed.mean() > self.layout_threshold
+        ):
+            return None
+        recognized = self._recognize_boxes(grey, [boxes[i] for i in changed])
+        for i, result in zip(changed, recognized):
+            results[i] = result
+        self.counters['boxes_reused'] += len(boxes) - len(changed)
+        self.counters['boxes_recognized'] += len(changed)
+        self.layouts.put(cache_key, {
+            'grey': grey,
+            'origin': origin,
+            'boxes': boxes,
+            'results': results,
+        })
+        return [r for r in results if r is not None]
+
+    def _readtext(self, img: Image, key) -> list:
+        if not self.reuse_detection:
+            return self.reader.readtext(numpy.array(img))
+        grey = numpy.array(img.convert('L'))
+        if isinstance(key, AreaKey):
+            cache_key = (key.area, key.index)
+            origin = key.origin
+        else:
+            cache_key = key
+            origin = (0, 0)
+        layout = self.layouts.get(cache_key) if cache_key is not None else None
+        results = None
+        if layout and layout['grey'].shape == grey.shape:
+            results = self._reuse(grey, layout, cache_key, origin)
+        if results is None:
+            results = self._detect(grey, cache_key, origin)
+        return results
+
+    def recognize(self, img: Image, key=None) -> list[OCRResult]:
+        log.debug({
+            'message': 'Running EasyOCR',
+            'img.size': img.size,
+        })
+        if not self.reader:
+            self.setup()
+        if img.mode == '1':
+            img = img.convert('L')
+        self.counters['frames'] += 1
+        boxes = self._readtext(img, key)
+        text = ''.join(b[1] for b in boxes)
+        confidence = (
+            sum(len(b[1]) * b[2] for b in boxes) / len(text)
+            if text
+            else 0.0
+        )
+        return [OCRResult(text, confidence, self.name)]
+
+    def recognize_boxes(self, img: Image) -> list[TextBox]:
+        if not self.reader:
+            self.setup()
+        if img.mode == '1':
+            img = img.convert('L')
+        boxes = []
+        for points, text, conf in self.reader.readtext(numpy.array(img)):
+            xs = [int(p[0]) for p in points]
+            ys = [int(p[1]) for p in points]
+            boxes.append(
+                TextBox(min(xs), min(ys), max(xs), max(ys), text, conf)
+            )
+        return boxes
+
+    def metrics(self) -> dict:
+        if not self.reuse_detection:
+            return {}
+        c = self.counters
+        boxes = c['boxes_reused'] + c['boxes_recognized']
+        return {
+            **c,
+            'box_reuse_rate': c['boxes_reused'] / boxes if boxes else 0.0,
+            'detection_skip_rate': (
+                1 - c['detections'] / c['frames']
+                if c['frames']
+                else 0.0
+            ),
+        }
+
+
+_whitespace_re = re.compile(r'\s+')
+
+
+def _strip(results: Iterable[OCRResult]) -> list[OCRResult]:
+    """Readings without whitespace, most confident first."""
+    results = sorted(
+        (
+            OCRResult(
+                _whitespace_re.sub('', r.text),
+                r.confidence,
+                r.engine
+            )
+            for r in results
+        ),
+        key=lambda r: r.confidence,
+        reverse=True
+    )
+    return [r for r in results if r.text]
+
+
+def _vote(
+    votes: list[dict],
+    matcher: SequenceMatcher,
+    text: str,
+    confidence: float,
+    partial: bool = False
+):
+    opcodes = matcher.get_opcodes()
+    if partial:
+        # A reading of a part only covers a stretch of the backbone
+        while opcodes and opcodes[0][0] != 'equal':
+            opcodes.pop(0)
+        while opcodes and opcodes[-1][0] != 'equal':
+            opcodes.pop()
+    for tag, i0, i1, j0, j1 in opcodes:
+        if tag == 'equal' or (tag == 'replace' and i1 - i0 == j1 - j0):
+            for i, j in zip(range(i0, i1), range(j0, j1)):
+                c = text[j]
+                votes[i][c] = votes[i].get(c, 0.0) + confidence
+        elif tag == 'delete':
+            for i in range(i0, i1):
+                votes[i][''] = votes[i].get('', 0.0) + confidence
+
+
+def _elect(votes: list[dict]) -> str:
+    return ''.join(
+        max(v, key=v.get)
+        for v in votes
+    )
+
+
+def fuse(results: Iterable[OCRResult]) -> str:
+    """
+    Merge alternative readings into one text.
+
+    The most confident reading is the backbone. The others are aligned to it
+    character by character and every aligned character (or gap) gets a vote
+    weighted by the confidence of its reading.
+    """
+    results = _strip(results)
+    if not results:
+        return ''
+    backbone = results[0]
+    votes = [
+        {c: backbone.confidence}
+        for c in backbone.text
+    ]
+    for r in results[1:]:
+        matcher = SequenceMatcher(None, backbone.text, r.text, autojunk=False)
+        _vote(votes, matcher, r.text, r.confidence)
+    return _elect(votes)
+
+
+def consensus(
+    groups: list[list[OCRResult]],
+    max_alternates: int = 2,
+    min_overlap: float = 0.5
+) -> list[str]:
+    """
+    Reduce the readings of a capture to one best text and a few alternates.
+
+    `groups[0]` holds readings of the whole capture, e.g. at several
+    scales, the other groups readings of parts of it. Each group is fused.
+    The fused parts that share at least `min_overlap` of their characters
+    with the fused whole vote on the characters they cover. Parts that do
+    not, and whole readings the result does not contain, become alternates,
+    most confident first.
+
+    Returns the best text followed by at most `max_alternates` alternates.
+    """
+    fused = [
+        OCRResult(
+            fuse(group),
+            max((r.confidence for r in group), default=0.0)
+        )
+        for group in groups
+    ]
+    if not fused:
+        return []
+    whole = fused[0]
+    parts = [r for r in fused[1:] if r.text]
+    if not whole.text:
+        if not parts:
+            return []
+        whole = max(parts, key=lambda r: len(r.text) * r.confidence)
+        parts.remove(whole)
+    votes = [
+        {c: whole.confidence}
+        for c in whole.text
+    ]
+    unmatched = []
+    for r in parts:
+        matcher = SequenceMatcher(None, whole.text, r.text, autojunk=False)
+        matched = sum(b.size for b in matcher.get_matching_blocks())
+        if matched >= min_overlap * len(r.text):
+            _vote(votes, matcher, r.text, r.confidence, partial=True)
+        else:
+            unmatched.append(r)
+    best = _elect(votes)
+    texts = [best]
+    for r in sorted(
+        unmatched + _strip(groups[0]),
+        key=lambda r: r.confidence,
+        reverse=True
+    ):
+        if len(texts) > max_alternates:
+            break
+        if not any(r.text in t for t in texts):
+            texts.append(r.text)
+    return texts
+
+
+class OCRPool:
+    """
+    Run several engines concurrently on the same image.
+
+    Engines that do not answer within their timeout are skipped for the
+    image. Latency is that of the slowest engine that answered. A call that
+    timed out keeps its thread and the engine lock until it returns, so the
+    engine is skipped until then instead of queueing more calls behind it.
+    """
+
+    def __init__(self, engines: Iterable[OCREngine]):
+        self.engines = list(engines)
+        if not self.engines:
+            raise ValueError('No OCR engines enabled')
+        self.executor = ThreadPoolExecutor(
+            max_workers=2 * len(self.engines),
+            thread_name_prefix='ocr'
+        )
+        # engine name -> future of a call that timed out
+        self.stalled = {}
+        self.counters = {
+            'timeouts': 0,
+            'skipped': 0,
+        }
+        # The capture loop and the prefetch thread share the pool
+        self.lock = Lock()
+
+    def _available(self, engine: OCREngine) -> bool:
+        with self.lock:
+            future = self.stalled.get(engine.name)
+            if future is None:
+                return True
+            if not future.done():
+                self.counters['skipped'] += 1
+                return False
+            if self.stalled.pop(engine.name, None) is None:
+                return True
+        log.info({
+            'message': 'OCR engine recovered',
+            'engine': engine.name,
+        })
+        return True
+
+    def warmup(self):
+        start = perf_counter()
+        wait([
+            self.executor.submit(engine.warmup)
+            for engine in self.engines
+        ])
+        log.info({
+            'message': 'OCR engines warmed up',
+            'engines': [e.name for e in self.engines],
+            'seconds': perf_counter() - start,
+        })
+
+    @staticmethod
+    def _recognize(engine: OCREngine, img: Image, key) -> list[OCRResult]:
+        with stage(f'ocr:{engine.name}', size=img.size), engine.lock:
+            return engine.recognize(img, key)
+
+    def recognize(self, img: Image, key=None) -> list[OCRResult]:
+        start = perf_counter()
+        futures = {
+            self.executor.submit(self._recognize, engine, img, key): engine
+            for engine in self.engines
+            if self._available(engine)
+        }
+        results = []
+        for future, engine in futures.items():
+            remaining = engine.timeout - (perf_counter() - start)
+            try:
+                results.extend(future.result(timeout=max(remaining, 0)))
+            except TimeoutError:
+                with self.lock:
+                    self.counters['timeouts'] += 1
+                    self.stalled[engine.name] = future
+                log.warning({
+                    'message': 'OCR engine timed out',
+                    'engine': engine.name,
+                    'timeout': engine.timeout,
+                })
+            except Exception as e:
+                log.warning({
+                    'message': 'OCR engine failed',
+                    'engine': engine.name,
+                    'error': str(e),
+                })
+        log.debug({
+            'message': 'OCR results',
+            'results': [repr(r) for r in results],
+        })
+        return results
+
+    def recognize_boxes(self, img: Image) -> list[TextBox]:
+        """Text boxes from the first engine, the others are not fused."""
+        engine = self.engines[0]
+        with stage(f'ocr:{engine.name}'), engine.lock:
+            return engine.recognize_boxes(img)
+
+    def metrics(self) -> dict:
+        return {
+            **{
+                engine.name: engine.metrics()
+                for engine in self.engines
+                if engine.metrics()
+            },
+            'pool': dict(self.counters),
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def __call__(self, img: Image, key=None) -> str:
+        return fuse(self.recognize(img, key))
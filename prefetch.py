@@ -0,0 +1,196 @@
+from collections import deque
+from queue import (
+    PriorityQueue,
+    Empty,
+)
+from threading import (
+    Thread,
+    Lock,
+)
+from time import time
+from typing import Callable
+from logging import getLogger
+from profiler import stage
+from math import hypot
+
+log = getLogger('app')
+
+
+class Prefetcher:
+    """
+    Capture and OCR the places the cursor is about to reach.
+
+    The cursor trajectory is extrapolated linearly from recent samples. The
+    positions where the cursor will be after 1..`steps` loop intervals are
+    queued for a background worker, nearest first. When the cursor leaves the
+    predicted path, pending work is dropped and running work is abandoned at
+    the next `alive()` check.
+
+    Args:
+        fetch (Callable): `fetch(x, y, alive)` grabs and OCRs the capture
+            region at `(x, y)`. It should return None early once `alive()`
+            is False.
+        interval (float): The time in seconds between captures.
+        threshold (int): The distance in pixels within which a prefetched
+            result can serve a capture, and the deviation from the
+            predicted path that cancels the prediction.
+        steps (int): The number of intervals to look ahead.
+        max_age (float): Results older than this many seconds are dropped.
+    """
+
+    history: int = 6
+    steps: int = 2
+    max_age: float = 3.0
+
+    def __init__(
+        self,
+        fetch: Callable,
+        interval: float,
+        threshold: int,
+        steps: int = steps,
+        max_age: float = max_age,
+    ):
+        self.fetch = fetch
+        self.interval = interval
+        self.threshold = threshold
+        self.steps = steps
+        self.max_age = max_age
+        self.samples = deque(maxlen=self.history)
+        self.queue = PriorityQueue()
+        self.results = {}
+        self.lock = Lock()
+        self.generation = 0
+        self.prediction = None
+        self.counters = {
+            'scheduled': 0,
+            'completed': 0,
+            'cancelled': 0,
+            'hits': 0,
+        }
+        self._thread = Thread(
+            target=self._run,
+            name='prefetch',
+            daemon=True
+        )
+        self._thread.start()
+
+    def observe(self, x: int, y: int, t: float | None = None):
+        t = time() if t is None else t
+        self.samples.append((x, y, t))
+        if self.prediction and not self._on_path(x, y, t):
+            log.debug({
+                'message': 'Prefetch prediction failed',
+                'x': x,
+                'y': y,
+            })
+            self.cancel()
+
+    def _on_path(self, x: int, y: int, t: float) -> bool:
+        x0, y0, t0, vx, vy = self.prediction
+        dt = t - t0
+        return hypot(
+            x - (x0 + vx * dt),
+            y - (y0 + vy * dt)
+        ) <= self.threshold * 2
+
+    def velocity(self) -> tuple[float, float] | None:
+        if len(self.samples) < 2:
+            return None
+        x0, y0, t0 = self.samples[0]
+        x1, y1, t1 = self.samples[-1]
+        if t1 - t0 <= 0:
+            return None
+        return (x1 - x0) / (t1 - t0), (y1 - y0) / (t1 - t0)
+
+    def predict(self) -> list[tuple[int, int]]:
+        velocity = self.velocity()
+        if velocity is None:
+            return []
+        vx, vy = velocity
+        # A cursor that stays within the threshold needs no prefetch
+        if hypot(vx, vy) * self.interval < self.threshold:
+            return []
+        x, y, _ = self.samples[-1]
+        return [
+            (
+                int(x + vx * self.interval * step),
+                int(y + vy * self.interval * step),
+            )
+            for step in range(1, self.steps + 1)
+        ]
+
+    def schedule(self, allowed: Callable = None):
+        """
+        Queue the predicted positions, unless they are already queued.
+
+        `allowed(x, y)` can veto positions, e.g. ones that would capture
+        the tooltip.
+        """
+        points = self.predict()
+        if not points:
+            return
+        if self.prediction and all(
+            self._on_path(px, py, self.samples[-1][2] + i * self.interval)
+            for i, (px, py) in enumerate(points, 1)
+        ):
+            return
+        self.cancel()
+        x, y, t = self.samples[-1]
+        self.prediction = (x, y, t, *self.velocity())
+        for priority, (px, py) in enumerate(points):
+            if allowed and not allowed(px, py):
+                continue
+            self.queue.put((priority, self.generation, px, py))
+            self.counters['scheduled'] += 1
+
+    def cancel(self):
+        self.generation += 1
+        self.prediction = None
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                break
+            self.counters['cancelled'] += 1
+
+    def take(self, x: int, y: int):
+        """Pop a fresh result prefetched within the threshold of `(x, y)`."""
+        now = time()
+        with self.lock:
+            for (px, py), (t, value) in list(self.results.items()):
+                if now - t > self.max_age:
+                    del self.results[(px, py)]
+                elif hypot(px - x, py - y) <= self.threshold:
+                    del self.results[(px, py)]
+                    self.counters['hits'] += 1
+                    return value
+        return None
+
+    def _run(self):
+        while True:
+            _, generation, x, y = self.queue.get()
+
+            def alive():
+                return generation == self.generation
+
+            if not alive():
+                self.counters['cancelled'] += 1
+                continue
+            try:
+                with stage('prefetch'):
+                    value = self.fetch(x, y, alive)
+            except Exception as e:
+                log.warning({
+                    'message': 'Prefetch failed',
+                    'error': str(e),
+                })
+                continue
+            if value is None or not alive():
+                self.counters['cancelled'] += 1
+                continue
+            with self.lock:
+                self.results[(x, y)] = (time(), value)
+            self.counters['completed'] += 1
+
+    def metrics(self) -> dict:
+        return dict(self.counters)
@@ -0,0 +1,194 @@
+from PIL import (
+    Image,
+)
+from typing import Iterable
+from logging import getLogger
+import numpy
+
+log = getLogger('app')
+
+STEPS = ('invert', 'normalize', 'binarize')
+
+
+def grayscale(a: numpy.ndarray) -> numpy.ndarray:
+    if a.ndim == 2:
+        return a
+    return a[..., :3] @ numpy.array(
+        [0.299, 0.587, 0.114],
+        dtype=numpy.float32
+    )
+
+
+def invert(a: numpy.ndarray) -> numpy.ndarray:
+    # Text covers a small part of the capture, so the median is the
+    # background. Engines prefer dark text on light background.
+    if numpy.median(a) < 128:
+        return 255 - a
+    return a
+
+
+def normalize(
+    a: numpy.ndarray,
+    low: float = 1,
+    high: float = 99
+) -> numpy.ndarray:
+    lo, hi = numpy.percentile(a, (low, high))
+    if hi - lo < 1:
+        return a
+    return numpy.clip((a - lo) * (255 / (hi - lo)), 0, 255)
+
+
+def otsu_threshold(a: numpy.ndarray) -> float:
+    hist = numpy.bincount(
+        a.astype(numpy.uint8).ravel(),
+        minlength=256
+    ).astype(numpy.float64)
+    levels = numpy.arange(256)
+    weight_bg = numpy.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    sum_bg = numpy.cumsum(hist * levels)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_bg[-1] - sum_bg) / weight_fg
+        variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return float(numpy.argmax(numpy.nan_to_num(variance)))
+
+
+def binarize(a: numpy.ndarray) -> numpy.ndarray:
+    return numpy.where(a > otsu_threshold(a), 255, 0).astype(numpy.float32)
+
+
+def _runs(mask: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """Start and end indices of the runs of True in a 1-d mask."""
+    edges = numpy.diff(numpy.concatenate(([0], mask.astype(numpy.int8), [0])))
+    return numpy.flatnonzero(edges == 1), numpy.flatnonzero(edges == -1)
+
+
+def _ink(img: Image) -> numpy.ndarray:
+    """Mask of the dark side of the Otsu split, after `invert`."""
+    a = invert(grayscale(numpy.asarray(img, dtype=numpy.float32)))
+    return a <= otsu_threshold(a)
+
+
+def estimate_glyph_height(
+    img: Image,
+    min_height: int = 4,
+    ink_fraction: float = 0.01
+) -> float | None:
+    """
+    Estimate the height of the dominant text lines in pixels.
+
+    The capture is binarised to dark ink on light background, and the runs
+    of rows containing ink (the horizontal projection profile) are taken as
+    text lines. Runs cut by the image border are ignored unless there are
+    no others. Returns None when no text-like runs are found.
+    """
+    ink = _ink(img)
+    rows = ink.mean(axis=1) > ink_fraction
+    starts, ends = _runs(rows)
+    lengths = ends - starts
+    inner = (starts > 0) & (ends < len(rows))
+    if inner.any():
+        lengths = lengths[inner]
+    lengths = lengths[lengths >= min_height]
+    if not len(lengths):
+        return None
+    return float(numpy.median(lengths))
+
+
+def auto_scale(
+    img: Image,
+    target_height: float,
+    min_scale: float = 0.25,
+    max_scale: float = 4.0
+) -> float:
+    """
+    The resampling factor that brings the text in `img` to `target_height`.
+    """
+    height = estimate_glyph_height(img)
+    if height is None:
+        return 1.0
+    return float(numpy.clip(target_height / height, min_scale, max_scale))
+
+
+def _gap_ratio(mask: numpy.ndarray) -> float | None:
+    """Median inner gap length relative to the median run length."""
+    starts, ends = _runs(mask)
+    if len(starts) < 2:
+        return None
+    gaps = starts[1:] - ends[:-1]
+    return float(numpy.median(gaps) / numpy.median(ends - starts))
+
+
+def text_orientation(
+    img: Image,
+    ink_fraction: float = 0.01,
+    line_gap: float = 0.3
+) -> str:
+    """
+    Guess whether `img` holds 'horizontal' or 'vertical' text.
+
+    Along the reading direction the projection profile has short gaps
+    between characters, across it the gaps between lines are wider
+    compared to the line thickness. When the profiles say nothing, e.g. a
+    single glyph, the aspect ratio decides.
+    """
+    ink = _ink(img)
+    rows = _gap_ratio(ink.mean(axis=1) > ink_fraction)
+    cols = _gap_ratio(ink.mean(axis=0) > ink_fraction)
+    if rows is not None and cols is not None:
+        return 'horizontal' if rows >= cols else 'vertical'
+    if rows is not None:
+        return 'horizontal' if rows >= line_gap else 'vertical'
+    if cols is not None:
+        return 'vertical' if cols >= line_gap else 'horizontal'
+    return 'vertical' if img.height > img.width else 'horizontal'
+
+
+STEP_FUNCTIONS = {
+    'invert': invert,
+    'normalize': normalize,
+    'binarize': binarize,
+}
+
+
+class Preprocessor:
+    """
+    Clean up captures before OCR.
+
+    The image is always converted to grayscale, then the enabled `steps` are
+    applied in order. The result is an 8-bit (`L`) or a 1-bit (`1`) image,
+    depending on `bits`. 1-bit output implies `binarize`.
+    """
+
+    steps: Iterable[str] = STEPS
+    bits: int = 8
+
+    def __init__(
+        self,
+        steps: Iterable[str] = steps,
+        bits: int = bits
+    ):
+        if isinstance(steps, str):
+            steps = [s.strip() for s in steps.split(',') if s.strip()]
+        unknown = [s for s in steps if s not in STEP_FUNCTIONS]
+        if unknown:
+            raise ValueError(f'Unknown preprocessing steps: {unknown}')
+        if bits not in (1, 8):
+            raise ValueError(f'Unsupported bit depth: {bits}')
+        if bits == 1 and 'binarize' not in steps:
+            steps = [*steps, 'binarize']
+        self.steps = list(steps)
+        self.bits = bits
+
+    def array(self, img: Image) -> numpy.ndarray:
+        a = grayscale(numpy.asarray(img, dtype=numpy.float32))
+        for step in self.steps:
+            a = STEP_FUNCTIONS[step](a)
+        return a.astype(numpy.uint8)
+
+    def __call__(self, img: Image) -> Image:
+        a = self.array(img)
+        if self.bits == 1:
+            return Image.fromarray(a > 127)
+        return Image.fromarray(a)
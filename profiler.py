@@ -0,0 +1,339 @@
+from pathlib import Path
+from threading import (
+    Thread,
+    Event,
+    get_ident,
+    current_thread,
+    enumerate as threads,
+)
+from contextlib import contextmanager
+from collections import (
+    Counter,
+    deque,
+)
+from time import (
+    perf_counter,
+    time,
+)
+from logging import getLogger
+import signal
+import json
+import sys
+import os
+
+log = getLogger('app')
+
+# Current pipeline stage per thread id, read by the sampler
+_stages: dict[int, str] = {}
+# The running SpanTracer, if any
+_tracer = None
+
+
+@contextmanager
+def stage(name: str, **args):
+    """
+    Mark the pipeline stage the current thread is in.
+
+    Cheap enough to leave in the hot loop when no profiler is running.
+    Yields `args`, the arguments of the span recorded by a running
+    `SpanTracer`, so the block can add what it learns, e.g. text length.
+    """
+    thread_id = get_ident()
+    previous = _stages.get(thread_id)
+    _stages[thread_id] = name
+    tracer = _tracer
+    start = perf_counter() if tracer else 0.0
+    try:
+        yield args
+    finally:
+        if tracer:
+            tracer.span(name, start, perf_counter(), thread_id, args)
+        if previous is None:
+            _stages.pop(thread_id, None)
+        else:
+            _stages[thread_id] = previous
+
+
+class SamplingProfiler:
+    """
+    Periodically sample the stacks of all threads.
+
+    Samples are written as collapsed stacks (`frame;frame;frame count`), one
+    file per flush window, readable by flamegraph.pl, speedscope and similar
+    tools. Every stack is rooted at the thread name and the pipeline stage
+    set with `stage`.
+
+    Args:
+        prefix (str): Path prefix of the written files.
+        interval (float): Seconds between samples.
+        flush_interval (float): Seconds between writing the collected samples.
+    """
+
+    prefix: str = 'sample_profile'
+    interval: float = 0.005
+    flush_interval: float = 30.0
+
+    def __init__(
+        self,
+        prefix: str = prefix,
+        interval: float = interval,
+        flush_interval: float = flush_interval,
+    ):
+        self.prefix = prefix
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.samples = Counter()
+        self.stage_samples = Counter()
+        self._stop = Event()
+        self._thread = None
+        self._flushes = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = Thread(
+            target=self._run,
+            name='sampling-profiler',
+            daemon=True
+        )
+        self._thread.start()
+        log.info({
+            'message': 'Sampling profiler started',
+            'prefix': self.prefix,
+            'interval': self.interval,
+        })
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+        log.info({'message': 'Sampling profiler stopped'})
+
+    def toggle(self, *args):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def install_signal(self, signum=None):
+        """Toggle the profiler on `signum`, SIGUSR1 by default."""
+        signum = signum or getattr(signal, 'SIGUSR1', None)
+        if signum is None:
+            log.debug({
+                'message': 'No signal available to toggle the profiler',
+            })
+            return
+        signal.signal(signum, self.toggle)
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f'{Path(code.co_filename).name}:{code.co_name}'
+
+    def _sample(self):
+        names = {t.ident: t.name for t in threads()}
+        own = get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame))
+                frame = frame.f_back
+            stage_name = _stages.get(thread_id, 'idle')
+            stack.append(f'stage:{stage_name}')
+            stack.append(names.get(thread_id, str(thread_id)))
+            self.samples[';'.join(reversed(stack))] += 1
+            self.stage_samples[stage_name] += 1
+
+    def _run(self):
+        next_flush = perf_counter() + self.flush_interval
+        while not self._stop.wait(self.interval):
+            self._sample()
+            if perf_counter() >= next_flush:
+                self.flush()
+                next_flush = perf_counter() + self.flush_interval
+
+    def flush(self):
+        if not self.samples:
+            return
+        samples, self.samples = self.samples, Counter()
+        stage_samples, self.stage_samples = self.stage_samples, Counter()
+        path = Path(f'{self.prefix}-{int(time())}-{self._flushes}.collapsed')
+        self._flushes += 1
+        path.write_text(''.join(
+            f'{stack} {count}\n'
+            for stack, count in samples.items()
+        ))
+        total = sum(stage_samples.values())
+        log.info({
+            'message': 'Sampling profile flushed',
+            'path': str(path),
+            'samples': total,
+            'stages': {
+                name: {
+                    'samples': count,
+                    'seconds': count * self.interval,
+                    'share': count / total,
+                }
+                for name, count in stage_samples.most_common()
+            },
+        })
+
+
+class SpanTracer:
+    """
+    Record `stage` spans as Chrome trace events.
+
+    Spans of all threads go to a bounded buffer; a background thread
+    appends them to `{prefix}-{time}.json` every `flush_interval` seconds,
+    so sessions of any length can be traced. When the writer falls behind,
+    the oldest spans are dropped and counted. The file is in the JSON array
+    format of the trace event spec, which may be opened in Perfetto or
+    chrome://tracing while it is still being written.
+
+    Args:
+        prefix (str): Path prefix of the written file.
+        buffer_size (int): The number of spans buffered between flushes.
+        flush_interval (float): Seconds between writing buffered spans.
+    """
+
+    prefix: str = 'spans'
+    buffer_size: int = 100000
+    flush_interval: float = 1.0
+
+    def __init__(
+        self,
+        prefix: str = prefix,
+        buffer_size: int = buffer_size,
+        flush_interval: float = flush_interval,
+    ):
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.events = deque(maxlen=buffer_size)
+        # Frame id added to every span, set by the capture loop
+        self.frame = 0
+        self.pid = os.getpid()
+        self.origin = perf_counter()
+        self.path = None
+        self.file = None
+        # Thread names by id, taken while the threads are alive
+        self.names = {}
+        self.written_names = set()
+        self.counters = {
+            'spans': 0,
+            'written': 0,
+            'dropped': 0,
+        }
+        self._stop = Event()
+        self._thread = None
+
+    def span(self, name: str, start: float, end: float, thread_id, args):
+        if thread_id not in self.names:
+            self.names[thread_id] = current_thread().name
+        if len(self.events) == self.events.maxlen:
+            self.counters['dropped'] += 1
+        self.events.append((name, start, end, thread_id, self.frame, args))
+        self.counters['spans'] += 1
+
+    def start(self):
+        global _tracer
+        if self._thread:
+            return
+        self.path = Path(f'{self.prefix}-{int(time())}.json')
+        self.file = open(self.path, 'w', encoding='utf-8')
+        self.file.write('[\n')
+        self._stop.clear()
+        self._thread = Thread(
+            target=self._run,
+            name='span-tracer',
+            daemon=True
+        )
+        self._thread.start()
+        _tracer = self
+        log.info({
+            'message': 'Span tracer started',
+            'path': str(self.path),
+        })
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _event(self, name, start, end, thread_id, frame, args) -> dict:
+        return {
+            'name': name,
+            'cat': name.split(':')[0],
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': self.pid,
+            'tid': thread_id,
+            'args': {'frame': frame, **args},
+        }
+
+    def _thread_names(self, thread_ids: set) -> list[dict]:
+        return [
+            {
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': self.pid,
+                'tid': thread_id,
+                'args': {'name': self.names.get(thread_id, str(thread_id))},
+            }
+            for thread_id in thread_ids
+        ]
+
+    def flush(self):
+        if not self.file:
+            return
+        events = []
+        while True:
+            try:
+                events.append(self.events.popleft())
+            except IndexError:
+                break
+        new_threads = {e[3] for e in events} - self.written_names
+        self.written_names |= new_threads
+        self.file.write(''.join(
+            json.dumps(event, default=str) + ',\n'
+            for event in [
+                *self._thread_names(new_threads),
+                *(self._event(*e) for e in events),
+            ]
+        ))
+        self.file.flush()
+        self.counters['written'] += len(events)
+
+    def stop(self):
+        global _tracer
+        if not self._thread:
+            return
+        _tracer = None
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+        # The last event has no trailing comma, closing the array
+        self.file.write(json.dumps({
+            'name': 'process_name',
+            'ph': 'M',
+            'pid': self.pid,
+            'args': {'name': 'kanji-translator'},
+        }))
+        self.file.write('\n]\n')
+        self.file.close()
+        self.file = None
+        log.info({
+            'message': 'Span tracer stopped',
+            'path': str(self.path),
+            **self.counters,
+        })
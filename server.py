@@ -0,0 +1,324 @@
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import (
+    urlsplit,
+    parse_qs,
+)
+from typing import (
+    Callable,
+    Iterable,
+)
+from logging import getLogger
+import asyncio
+import json
+
+log = getLogger('app')
+
+STATUS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large',
+}
+
+LOCAL_HOSTS = {'127.0.0.1', 'localhost', '::1'}
+
+
+class Subscriber:
+
+    def __init__(self, writer: asyncio.StreamWriter, queue_size: int):
+        self.writer = writer
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+
+class StreamServer:
+    """
+    Local HTTP server publishing every frame to any number of clients.
+
+    Endpoints:
+        GET /events: Server-sent events, one `frame` event per frame.
+        GET /latest: The latest frame as JSON.
+        GET /lookup?text=...: Dictionary entries for arbitrary text.
+        POST /lookup: Same, with the text as the request body.
+
+    The server runs its own event loop in a background thread. `publish`
+    only schedules the frame on that loop, so the capture loop is never
+    blocked. Every client has a queue of `queue_size` frames; a client that
+    lets its queue fill up is disconnected. Lookups run on a worker thread
+    with their own translator, created by `translator_factory` on first use.
+
+    Frames show what is on the screen, so web pages may only read them
+    from the origins in `allow_origins`, none by default. Requests must name
+    a local host, or the `host` listened on, in their `Host` header, so a
+    page whose domain resolves to this machine cannot read them either.
+
+    Args:
+        translator_factory (Callable): Creates the translator for lookups.
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        queue_size (int): The number of frames buffered per client.
+        max_entries (int): The number of entries returned by lookups.
+        allow_origins (Iterable[str]): Origins allowed to read responses
+            from a browser, e.g. `http://localhost:3000`, or `*` for any.
+        max_body (int): The largest request body accepted, in bytes.
+        max_headers (int): The largest request head accepted, in bytes.
+        max_text (int): The longest text accepted by lookups.
+    """
+
+    host: str = '127.0.0.1'
+    port: int = 8765
+    queue_size: int = 16
+    max_entries: int = 8
+    allow_origins: Iterable[str] = ()
+    max_body: int = 16384
+    max_headers: int = 8192
+    max_text: int = 1000
+
+    def __init__(
+        self,
+        translator_factory: Callable,
+        host: str = host,
+        port: int = port,
+        queue_size: int = queue_size,
+        max_entries: int = max_entries,
+        allow_origins: Iterable[str] = allow_origins,
+        max_body: int = max_body,
+        max_headers: int = max_headers,
+        max_text: int = max_text,
+    ):
+        self.translator_factory = translator_factory
+        self.translator = None
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.max_entries = max_entries
+        if isinstance(allow_origins, str):
+            allow_origins = [
+                o.strip() for o in allow_origins.split(',') if o.strip()
+            ]
+        self.allow_origins = set(allow_origins)
+        self.max_body = max_body
+        self.max_headers = max_headers
+        self.max_text = max_text
+        self.subscribers = set()
+        self.latest = None
+        self.loop = None
+        self.lookups = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix='server-lookup'
+        )
+        self.counters = {
+            'frames': 0,
+            'clients': 0,
+            'dropped_clients': 0,
+            'lookups': 0,
+        }
+
+    def start(self):
+
+        async def serve():
+            server = await asyncio.start_server(
+                self._handle,
+                self.host,
+                self.port
+            )
+            log.info({
+                'message': 'Stream server listening',
+                'host': self.host,
+                'port': self.port,
+            })
+            async with server:
+                await server.serve_forever()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            self.loop.run_until_complete(serve())
+
+        Thread(target=run, name='stream-server', daemon=True).start()
+
+    def publish(self, frame: dict):
+        """Hand a frame to the server thread, never blocks."""
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self._broadcast, frame)
+
+    def _broadcast(self, frame: dict):
+        self.counters['frames'] += 1
+        self.latest = json.dumps(frame, ensure_ascii=False)
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber.queue.put_nowait(self.latest)
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+
+    def _drop(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+        self.counters['dropped_clients'] += 1
+        # Wake up the client's writer, whether it waits for frames or for
+        # the socket to drain, so that it can finish
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+        subscriber.writer.transport.abort()
+        log.warning({'message': 'Dropped slow stream client'})
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        if not request_line:
+            return None
+        method, target, _ = request_line.split(' ', 2)
+        headers = {}
+        size = len(request_line)
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            size += len(line)
+            if size > self.max_headers:
+                # The connection is closed after the reply
+                return method, target, None, None
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length > self.max_body:
+            # Leave the body unread, the connection is closed after the reply
+            return method, target, headers, None
+        body = await reader.readexactly(length) if length else b''
+        return method, target, headers, body
+
+    def _local_host(self, headers: dict) -> bool:
+        host = headers.get('host', '')
+        if host.startswith('['):
+            host = host[1:].partition(']')[0]
+        else:
+            host = host.partition(':')[0]
+        return host.lower() in LOCAL_HOSTS or host == self.host
+
+    def _cors(self, headers: dict) -> str:
+        origin = headers.get('origin')
+        if '*' in self.allow_origins:
+            return 'Access-Control-Allow-Origin: *\r\n'
+        if origin and origin in self.allow_origins:
+            return (
+                f'Access-Control-Allow-Origin: {origin}\r\n'
+                'Vary: Origin\r\n'
+            )
+        return ''
+
+    @staticmethod
+    def _response(
+        status: int,
+        body: str = '',
+        content_type: str = 'application/json; charset=utf-8',
+        cors: str = '',
+    ) -> bytes:
+        data = body.encode('utf-8')
+        head = (
+            f'HTTP/1.1 {status} {STATUS[status]}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(data)}\r\n'
+            f'{cors}'
+            'Connection: close\r\n'
+            '\r\n'
+        )
+        return head.encode('latin-1') + data
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await self._read_request(reader)
+            if request is None:
+                return
+            method, target, headers, body = request
+            if headers is None:
+                writer.write(self._response(431))
+                await writer.drain()
+                return
+            if not self._local_host(headers):
+                writer.write(self._response(400))
+                await writer.drain()
+                return
+            cors = self._cors(headers)
+            url = urlsplit(target)
+            if body is None:
+                writer.write(self._response(413, cors=cors))
+            elif url.path == '/events' and method == 'GET':
+                await self._events(writer, cors)
+                return
+            elif url.path == '/latest' and method == 'GET':
+                writer.write(
+                    self._response(200, self.latest or 'null', cors=cors)
+                )
+            elif url.path == '/lookup' and method in ('GET', 'POST'):
+                text = (
+                    body.decode('utf-8')
+                    if method == 'POST'
+                    else parse_qs(url.query).get('text', [''])[0]
+                )
+                if len(text) > self.max_text:
+                    writer.write(self._response(413, cors=cors))
+                else:
+                    entries = await self._lookup(text)
+                    writer.write(self._response(
+                        200,
+                        json.dumps(
+                            {'text': text, 'entries': entries},
+                            ensure_ascii=False
+                        ),
+                        cors=cors
+                    ))
+            elif url.path in ('/events', '/latest', '/lookup'):
+                writer.write(self._response(405, cors=cors))
+            else:
+                writer.write(self._response(404, cors=cors))
+            await writer.drain()
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError) as e:
+            log.debug({
+                'message': 'Stream client error',
+                'error': str(e),
+            })
+        finally:
+            writer.close()
+
+    async def _events(self, writer, cors: str = ''):
+        subscriber = Subscriber(writer, self.queue_size)
+        self.subscribers.add(subscriber)
+        self.counters['clients'] += 1
+        writer.write((
+            'HTTP/1.1 200 OK\r\n'
+            'Content-Type: text/event-stream; charset=utf-8\r\n'
+            'Cache-Control: no-cache\r\n'
+            f'{cors}'
+            '\r\n'
+        ).encode('latin-1'))
+        if self.latest:
+            subscriber.queue.put_nowait(self.latest)
+        try:
+            while True:
+                data = await subscriber.queue.get()
+                if data is None:
+                    break
+                writer.write(f'event: frame\ndata: {data}\n\n'.encode())
+                await writer.drain()
+        finally:
+            self.subscribers.discard(subscriber)
+
+    def _lookup_sync(self, text: str) -> list:
+        if self.translator is None:
+            self.translator = self.translator_factory()
+        return self.translator.text_kanji_info(text, k=self.max_entries)
+
+    async def _lookup(self, text: str) -> list:
+        self.counters['lookups'] += 1
+        return await asyncio.get_running_loop().run_in_executor(
+            self.lookups,
+            self._lookup_sync,
+            text
+        )
+
+    def metrics(self) -> dict:
+        return {
+            **self.counters,
+            'subscribers': len(self.subscribers),
+        }
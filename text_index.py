@@ -0,0 +1,165 @@
+from PIL import (
+    Image,
+)
+from hashlib import blake2b
+from typing import Callable
+from logging import getLogger
+from capture import Region
+from ocr import TextBox
+import numpy
+
+log = getLogger('app')
+
+
+class TextIndex:
+    """
+    Spatial index of the text in a screen area.
+
+    The area is split into tiles. Each tile is OCRed with a `margin` around
+    it so that text crossing tile borders is read whole; a box belongs to the
+    tile its centre is in. `refresh` hashes every tile of a new grab of the
+    area together with its margin, as a change there can move a box in or
+    out of the tile, and only re-OCRs the tiles whose hash changed. Boxes
+    are kept in a uniform grid of `cell_size` cells, so `query` only looks
+    at the cells the query rectangle covers.
+
+    Args:
+        area (Region): Screen coordinates of the indexed area.
+        recognize (Callable): `recognize(img)` returns the `TextBox`es of
+            `img` in image coordinates.
+        tile_size (int): Tile width and height in pixels.
+        cell_size (int): Grid cell width and height in pixels.
+        margin (int): Extra pixels around each tile when OCRing it.
+    """
+
+    tile_size: int = 256
+    cell_size: int = 64
+    margin: int = 32
+
+    def __init__(
+        self,
+        area: Region,
+        recognize: Callable,
+        tile_size: int = tile_size,
+        cell_size: int = cell_size,
+        margin: int = margin,
+    ):
+        self.area = area
+        self.recognize = recognize
+        self.tile_size = tile_size
+        self.cell_size = cell_size
+        self.margin = margin
+        self.tiles = {}
+        self.grid = {}
+        self.counters = {
+            'refreshes': 0,
+            'tiles_checked': 0,
+            'tiles_dirty': 0,
+            'queries': 0,
+        }
+
+    def _tile_rects(self, width: int, height: int):
+        for y in range(0, height, self.tile_size):
+            for x in range(0, width, self.tile_size):
+                yield (
+                    (x, y),
+                    (
+                        x,
+                        y,
+                        min(x + self.tile_size, width),
+                        min(y + self.tile_size, height),
+                    )
+                )
+
+    def _ocr_rect(self, rect: Region, width: int, height: int) -> Region:
+        """The tile `rect` with its margin, clipped to the image."""
+        x0, y0, x1, y1 = rect
+        return (
+            max(x0 - self.margin, 0),
+            max(y0 - self.margin, 0),
+            min(x1 + self.margin, width),
+            min(y1 + self.margin, height),
+        )
+
+    def _cells(self, x0: int, y0: int, x1: int, y1: int):
+        c = self.cell_size
+        for cy in range(y0 // c, (y1 - 1) // c + 1):
+            for cx in range(x0 // c, (x1 - 1) // c + 1):
+                yield (cx, cy)
+
+    def _remove(self, boxes: list[TextBox]):
+        for box in boxes:
+            for cell in self._cells(box.x0, box.y0, box.x1, box.y1):
+                cell_boxes = self.grid.get(cell)
+                if cell_boxes:
+                    cell_boxes.discard(box)
+                    if not cell_boxes:
+                        del self.grid[cell]
+
+    def _add(self, boxes: list[TextBox]):
+        for box in boxes:
+            for cell in self._cells(box.x0, box.y0, box.x1, box.y1):
+                self.grid.setdefault(cell, set()).add(box)
+
+    def _ocr_tile(self, img: Image, rect: Region) -> list[TextBox]:
+        x0, y0, x1, y1 = rect
+        ox0, oy0, ox1, oy1 = self._ocr_rect(rect, img.width, img.height)
+        ax, ay = self.area[0], self.area[1]
+        boxes = []
+        for box in self.recognize(img.crop((ox0, oy0, ox1, oy1))):
+            cx = ox0 + (box.x0 + box.x1) // 2
+            cy = oy0 + (box.y0 + box.y1) // 2
+            if x0 <= cx < x1 and y0 <= cy < y1:
+                boxes.append(box.moved(ox0 + ax, oy0 + ay))
+        return boxes
+
+    def refresh(self, img: Image) -> int:
+        """Update the index from a grab of the area, return dirty tiles."""
+        pixels = numpy.asarray(img)
+        dirty = 0
+        for tile, rect in self._tile_rects(img.width, img.height):
+            x0, y0, x1, y1 = self._ocr_rect(rect, img.width, img.height)
+            digest = blake2b(
+                numpy.ascontiguousarray(pixels[y0:y1, x0:x1]),
+                digest_size=16
+            ).digest()
+            self.counters['tiles_checked'] += 1
+            old = self.tiles.get(tile)
+            if old and old['hash'] == digest:
+                continue
+            dirty += 1
+            if old:
+                self._remove(old['boxes'])
+            boxes = self._ocr_tile(img, rect)
+            self._add(boxes)
+            self.tiles[tile] = {'hash': digest, 'boxes': boxes}
+        self.counters['refreshes'] += 1
+        self.counters['tiles_dirty'] += dirty
+        log.debug({
+            'message': 'Text index refreshed',
+            'dirty_tiles': dirty,
+            'boxes': sum(len(t['boxes']) for t in self.tiles.values()),
+        })
+        return dirty
+
+    def query(self, rect: Region) -> list[TextBox]:
+        """Boxes intersecting the screen rectangle, in reading order."""
+        self.counters['queries'] += 1
+        x0, y0, x1, y1 = rect
+        found = set()
+        for cell in self._cells(x0, y0, x1, y1):
+            for box in self.grid.get(cell, ()):
+                if box.intersects(x0, y0, x1, y1):
+                    found.add(box)
+        return sorted(found, key=lambda b: (b.y0, b.x0))
+
+    def metrics(self) -> dict:
+        c = self.counters
+        return {
+            **c,
+            'dirty_rate': (
+                c['tiles_dirty'] / c['tiles_checked']
+                if c['tiles_checked']
+                else 0.0
+            ),
+        }
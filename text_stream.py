@@ -0,0 +1,292 @@
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
+from typing import (
+    Iterable,
+    Iterator,
+    TextIO,
+)
+from logging import (
+    getLogger,
+    DEBUG,
+    INFO,
+)
+from kanji_translator import KanjiTranslator
+from threads import available_cpus
+from log import (
+    configure_logger,
+    TRACE,
+)
+import json
+import re
+import sys
+
+log = getLogger('app')
+
+TEXT_SUFFIXES = ['.txt', '.srt', '.ass', '.ssa']
+
+_srt_time_re = re.compile(
+    r'(\d+:\d+:\d+[,.]\d+)\s*-->\s*(\d+:\d+:\d+[,.]\d+)'
+)
+_srt_tag_re = re.compile(r'</?[a-zA-Z][^>]*>')
+_ass_tag_re = re.compile(r'\{[^}]*\}')
+
+
+def read_plain(lines: Iterable[str], source: str) -> Iterator[dict]:
+    for n, line in enumerate(lines, 1):
+        text = line.strip()
+        if text:
+            yield {'source': source, 'line': n, 'text': text}
+
+
+def read_srt(lines: Iterable[str], source: str) -> Iterator[dict]:
+    cue = None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            if cue and cue.get('text'):
+                yield cue
+            cue = None
+            continue
+        match = _srt_time_re.match(line)
+        if match:
+            cue = {
+                'source': source,
+                'index': cue['index'] if cue else None,
+                'start': match[1],
+                'end': match[2],
+                'text': '',
+            }
+        elif cue is None:
+            cue = {'index': int(line) if line.isdigit() else None}
+        elif 'text' in cue:
+            text = _srt_tag_re.sub('', line)
+            cue['text'] = f'{cue["text"]}\n{text}' if cue['text'] else text
+    if cue and cue.get('text'):
+        yield cue
+
+
+def read_ass(lines: Iterable[str], source: str) -> Iterator[dict]:
+    fields = None
+    in_events = False
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if line.startswith('['):
+            in_events = line.lower() == '[events]'
+            continue
+        if not in_events:
+            continue
+        kind, _, value = line.partition(':')
+        if kind == 'Format':
+            fields = [f.strip() for f in value.split(',')]
+        elif kind == 'Dialogue' and fields:
+            event = dict(zip(
+                fields,
+                (v.strip() for v in value.split(',', len(fields) - 1))
+            ))
+            text = (
+                _ass_tag_re.sub('', event.get('Text', ''))
+                .replace('\\N', '\n')
+                .replace('\\n', '\n')
+                .replace('\\h', ' ')
+                .strip()
+            )
+            if text:
+                yield {
+                    'source': source,
+                    'line': n,
+                    'start': event.get('Start'),
+                    'end': event.get('End'),
+                    'text': text,
+                }
+
+
+READERS = {
+    '.srt': read_srt,
+    '.ass': read_ass,
+    '.ssa': read_ass,
+}
+
+
+def read_items(path: str) -> Iterator[dict]:
+    """Text items of stdin (`-`), a file or the text files of a directory."""
+    if path == '-':
+        yield from read_plain(sys.stdin, '-')
+        return
+    path = Path(path)
+    paths = (
+        sorted(
+            p for p in path.iterdir()
+            if p.suffix.lower() in TEXT_SUFFIXES
+        )
+        if path.is_dir()
+        else [path]
+    )
+    for p in paths:
+        reader = READERS.get(p.suffix.lower(), read_plain)
+        # Subtitle files often start with a byte order mark
+        with open(p, encoding='utf-8-sig', errors='replace') as f:
+            yield from reader(f, str(p))
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+_translator = None
+
+
+def _init_worker(log_level: int = INFO, pretty: bool = False):
+    global _translator
+    # Spawned workers start with unconfigured loggers, without `log.trace`
+    if not hasattr(log, 'trace'):
+        configure_logger('app', level=log_level, pretty=pretty)
+    _translator = KanjiTranslator()
+
+
+def _gloss_batch(batch: list[dict], k: int | None) -> list[dict]:
+    return [
+        {**item, 'entries': _translator.text_kanji_info(item['text'], k=k)}
+        for item in batch
+    ]
+
+
+def gloss(
+    items: Iterable[dict],
+    processes: int,
+    batch_size: int,
+    window: int,
+    k: int | None,
+    log_level: int = INFO,
+    pretty: bool = False,
+) -> Iterator[dict]:
+    """
+    Look up the entries of every item, in input order.
+
+    Batches of `batch_size` items are spread over `processes` worker
+    processes. At most `window` batches are in flight, so memory does not
+    grow with the input.
+    """
+    if processes <= 1:
+        _init_worker()
+        for batch in batched(items, batch_size):
+            yield from _gloss_batch(batch, k)
+        return
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_worker,
+        initargs=(log_level, pretty),
+    ) as executor:
+        pending = deque()
+        for batch in batched(items, batch_size):
+            pending.append(executor.submit(_gloss_batch, batch, k))
+            if len(pending) >= window:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+class TextGlosser:
+    """
+    Look up the dictionary entries of text from stdin or files.
+
+    Plain text is read line by line, SRT and ASS/SSA subtitles cue by cue.
+    Every item is written as a JSON line with its source position, the
+    text and its entries.
+
+    Args:
+        processes (int): The number of worker processes, defaults to the
+            number of CPUs this process may run on. 1 runs the lookups in
+            this process.
+        batch_size (int): The number of items sent to a worker at once.
+        window (int): The number of batches in flight per process.
+        max_entries (int): The maximum number of entries per item, 0 for
+            all entries.
+        output (str): The file to write to, stdout by default.
+        debug (bool): Whether to enable debug logging.
+        trace (bool): Whether to enable trace logging.
+        pretty (bool): Whether to use pretty printing for logs.
+    """
+
+    processes: int | None = None
+    batch_size: int = 64
+    window: int = 4
+    max_entries: int = 8
+    output: str | None = None
+    debug: bool = False
+    trace: bool = False
+    pretty: bool = False
+
+    def __init__(
+        self,
+        *args,
+        processes: int | None = processes,
+        batch_size: int = batch_size,
+        window: int = window,
+        max_entries: int = max_entries,
+        output: str | None = output,
+        debug: bool = debug,
+        trace: bool = trace,
+        pretty: bool = pretty,
+    ):
+        self.processes = processes or len(available_cpus())
+        self.batch_size = batch_size
+        self.window = window
+        self.max_entries = max_entries
+        self.output = output
+        self.log_level = (
+            TRACE
+            if trace
+            else DEBUG
+            if debug
+            else INFO
+        )
+        self.pretty = pretty
+        configure_logger('app', level=self.log_level, pretty=pretty)
+
+    def _write(self, items: Iterable[dict], out: TextIO) -> tuple[int, int]:
+        count = 0
+        chars = 0
+        for item in items:
+            out.write(json.dumps(item, ensure_ascii=False))
+            out.write('\n')
+            count += 1
+            chars += len(item['text'])
+        out.flush()
+        return count, chars
+
+    def text(self, path: str = '-'):
+        """
+        Write the dictionary entries of text as JSON lines.
+
+        Args:
+            path (str): A text, SRT or ASS file, a directory of them, or `-`
+                for stdin.
+        """
+        start = perf_counter()
+        items = gloss(
+            read_items(path),
+            processes=self.processes,
+            batch_size=self.batch_size,
+            window=self.window * self.processes,
+            k=self.max_entries or None,
+            log_level=self.log_level,
+            pretty=self.pretty,
+        )
+        if self.output:
+            with open(self.output, 'w', encoding='utf-8') as out:
+                count, chars = self._write(items, out)
+        else:
+            count, chars = self._write(items, sys.stdout)
+        elapsed = perf_counter() - start
+        log.info({
+            'message': 'Text glossed',
+            'items': count,
+            'chars': chars,
+            'seconds': elapsed,
+            'chars_per_minute': chars * 60 / elapsed if elapsed else 0.0,
+        })
@@ -0,0 +1,108 @@
+from logging import getLogger
+import os
+
+log = getLogger('app')
+
+
+def available_cpus() -> list[int]:
+    """The CPUs this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def pin(cpus: list[int]) -> bool:
+    """Restrict this process to `cpus`, where the platform allows it."""
+    if not cpus or not hasattr(os, 'sched_setaffinity'):
+        return False
+    try:
+        os.sched_setaffinity(0, cpus)
+    except OSError as e:
+        log.warning({
+            'message': 'Could not pin process',
+            'cpus': cpus,
+            'error': str(e),
+        })
+        return False
+    return True
+
+
+class ThreadBudget:
+    """
+    Share a number of CPU threads between the OCR engines and processes.
+
+    Left alone, torch starts a thread per core, Tesseract starts its own
+    OpenMP threads and worker processes multiply both, so the machine is
+    oversubscribed and every frame gets slower. The budget is split evenly
+    between the OCR worker processes, or the app process without them.
+    Engines in a worker read one after the other and get the whole share;
+    engines in the app process read concurrently and split it. torch gets
+    one inter-op thread, as an engine runs one inference at a time.
+
+    With `pin`, every worker process is restricted to its own CPUs, and the
+    app process to the CPUs of the budget.
+
+    Args:
+        threads (int): The number of threads, 0 for all available CPUs.
+        pin (bool): Whether to pin processes to CPUs.
+    """
+
+    threads: int = 0
+    pin: bool = False
+    interop_threads: int = 1
+
+    def __init__(
+        self,
+        threads: int = threads,
+        pin: bool = pin,
+    ):
+        self.cpus = available_cpus()
+        self.threads = min(threads or len(self.cpus), len(self.cpus))
+        self.pin = pin
+
+    def processes(self, requested: int) -> int:
+        """The number of worker processes that fit the budget."""
+        return min(requested, self.threads)
+
+    def engine_threads(self, engines: list, processes: int) -> list[int]:
+        """Threads of each engine, in the order of `engines`."""
+        share = self.threads // max(processes, 1)
+        if processes or len(engines) <= 1:
+            return [share] * len(engines)
+        base, extra = divmod(share, len(engines))
+        # The first engines take the remainder, and every engine one thread
+        return [
+            max(base + (i < extra), 1)
+            for i in range(len(engines))
+        ]
+
+    def worker_cpus(self, processes: int) -> list[list[int]] | None:
+        """The CPUs of each worker process, when pinning."""
+        if not self.pin or not processes:
+            return None
+        cpus = self.cpus[:self.threads]
+        share = len(cpus) // processes
+        return [
+            cpus[i * share:(i + 1) * share]
+            for i in range(processes)
+        ]
+
+    def apply(self, engines: list, processes: int) -> dict:
+        """Limit the threads of `engines` and return the allocation."""
+        threads = self.engine_threads(engines, processes)
+        for engine, n in zip(engines, threads):
+            engine.use_threads(n, self.interop_threads)
+        pinned = self.pin and pin(self.cpus[:self.threads])
+        return {
+            'cpus': len(self.cpus),
+            'threads': self.threads,
+            'ocr_processes': processes,
+            'threads_per_process': self.threads // max(processes, 1),
+            'engines': {
+                engine.name: n
+                for engine, n in zip(engines, threads)
+            },
+            'torch_interop_threads': self.interop_threads,
+            'pinned': pinned,
+            'worker_cpus': self.worker_cpus(processes),
+        }
@@ -1,10 +1,15 @@
 from textwrap import wrap
+from collections import OrderedDict
 import os
+import sys
+import shutil
+import unicodedata
 from random import randint
 from hsluv import hsluv_to_rgb
 from contextlib import contextmanager
 from typing import Iterable
 from PIL import Image
+import numpy
 
 
 def first(iterable):
@@ -22,8 +27,72 @@ def all_substrings(s: Iterable, n: int = 6):
     ]
 
 
-def clear_tty():
-    os.system('cls' if on_windows() else 'clear')
+def char_width(c: str) -> int:
+    """Terminal cells taken by `c`, 2 for East Asian wide characters."""
+    if unicodedata.combining(c):
+        return 0
+    return 2 if unicodedata.east_asian_width(c) in ('W', 'F') else 1
+
+
+def clip(line: str, width: int) -> str:
+    """The longest prefix of `line` that fits `width` terminal cells."""
+    cells = 0
+    for i, c in enumerate(line):
+        cells += char_width(c)
+        if cells > width:
+            return line[:i]
+    return line
+
+
+class TerminalRenderer:
+    """
+    Redraw text in place with ANSI escape codes.
+
+    Only the lines that differ from the previous frame are rewritten, and an
+    identical frame writes nothing at all. Lines are placed on absolute
+    rows, so every line is clipped to the terminal width, counting wide
+    characters as two cells, and the frame to the terminal height. Frames
+    are redrawn in full when the terminal is resized.
+    """
+
+    def __init__(self, stream=None):
+        if on_windows():
+            from colorama import just_fix_windows_console
+            just_fix_windows_console()
+        self.stream = stream or sys.stdout
+        self.lines = None
+        self.size = None
+
+    def render(self, text: str) -> bool:
+        size = shutil.get_terminal_size()
+        if size != self.size:
+            self.size = size
+            self.lines = None
+        # One cell and one row short of the edges, so the terminal never
+        # wraps a line or scrolls the frame
+        lines = [
+            clip(line, size.columns - 1)
+            for line in text.split('\n')[:size.lines - 1]
+        ]
+        if lines == self.lines:
+            return False
+        if self.lines is None:
+            out = ['\x1b[2J']
+            old = []
+        else:
+            out = []
+            old = self.lines
+        for i, line in enumerate(lines):
+            if i < len(old) and old[i] == line:
+                continue
+            out.append(f'\x1b[{i + 1};1H{line}\x1b[K')
+        if len(lines) < len(old):
+            out.append(f'\x1b[{len(lines) + 1};1H\x1b[J')
+        out.append(f'\x1b[{len(lines) + 1};1H')
+        self.stream.write(''.join(out))
+        self.stream.flush()
+        self.lines = lines
+        return True
 
 
 def strings(v):
@@ -56,6 +125,74 @@ def combine_columns(*columns, separator=' '):
     )
 
 
+def layout_columns(*columns, separator=' '):
+    """
+    Lay out `(text, width, whitespace)` columns side by side in one pass.
+
+    Each text has its `whitespace` turned into spaces and is wrapped at
+    `width` characters, without breaking words. Words longer than `width`
+    stay on their own line, over width. Every line is stripped, padded to
+    `width` with `whitespace`, and has its spaces replaced by `whitespace`.
+    Columns shorter than the tallest are padded with blank lines, so no
+    line is dropped. Widths count characters, not terminal cells, so
+    full-width text is twice as wide on screen.
+    """
+    wrapped = [
+        (
+            wrap(text.replace(whitespace, ' '), width, break_long_words=False),
+            width,
+            whitespace
+        )
+        for text, width, whitespace in columns
+    ]
+    num_lines = max(
+        [1, *(len(lines) for lines, _, _ in wrapped)]
+    )
+    return '\n'.join(
+        separator.join(
+            (
+                (lines[i] if i < len(lines) else '')
+                .strip()
+                .ljust(width, whitespace)
+                .replace(' ', whitespace)
+            )
+            for lines, width, whitespace in wrapped
+        )
+        for i in range(num_lines)
+    )
+
+
+class LRUCache:
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+
 @contextmanager
 def nothing():
     yield
@@ -92,6 +229,27 @@ def scale_image(
         int(img.height * scale),
     ))
 
+def overlap(a: tuple, b: tuple) -> tuple | None:
+    """The intersection of two `(x0, y0, x1, y1)` boxes, if any."""
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[2], b[2]), min(a[3], b[3])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1, y1)
+
+
+def mask_box(img: Image, box: tuple) -> Image:
+    """Fill `box` of `img` with the median colour of the rest of it."""
+    x0, y0, x1, y1 = box
+    a = numpy.array(img)
+    covered = numpy.zeros(a.shape[:2], dtype=bool)
+    covered[max(y0, 0):y1, max(x0, 0):x1] = True
+    rest = a[~covered]
+    if len(rest):
+        a[covered] = numpy.median(rest, axis=0)
+    return Image.fromarray(a)
+
+
 def adjust_image(img: Image):
     return img.quantize(4).convert('RGB')
 
@@ -0,0 +1,479 @@
+from PIL import (
+    Image,
+)
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures import (
+    Future,
+    TimeoutError,
+)
+from collections import deque
+from threading import (
+    Thread,
+    Condition,
+    Lock,
+)
+from queue import Empty
+from time import (
+    perf_counter,
+    sleep,
+)
+from typing import Iterable
+from logging import getLogger
+from threads import pin
+from ocr import (
+    OCREngine,
+    OCRResult,
+    TextBox,
+    fuse,
+)
+import numpy
+
+log = getLogger('app')
+
+
+def frame_array(img: Image) -> tuple[numpy.ndarray, str]:
+    """The pixels of `img` as uint8 and the mode to restore it in."""
+    if img.mode == '1':
+        return numpy.asarray(img.convert('L')), '1'
+    if img.mode not in ('L', 'RGB'):
+        img = img.convert('RGB')
+    return numpy.asarray(img), img.mode
+
+
+class FrameRing:
+    """
+    Fixed size frame slots in one shared memory block.
+
+    Only the owning process writes. A slot is taken with `acquire`, filled
+    with `write` and handed to a worker by index; it is not reused until
+    `release`, which the owner calls once the worker answered or died.
+    """
+
+    def __init__(self, slots: int, slot_bytes: int):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.shm = SharedMemory(create=True, size=slots * slot_bytes)
+        self.name = self.shm.name
+        self.free = deque(range(slots))
+        self.cond = Condition()
+
+    def acquire(self, timeout: float | None = None) -> int | None:
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.free, timeout):
+                return None
+            return self.free.popleft()
+
+    def release(self, slot: int):
+        with self.cond:
+            self.free.append(slot)
+            self.cond.notify()
+
+    def write(self, slot: int, a: numpy.ndarray):
+        if a.nbytes > self.slot_bytes:
+            raise ValueError(
+                f'Frame of {a.nbytes} bytes does not fit in a slot of '
+                f'{self.slot_bytes} bytes'
+            )
+        view(self.shm.buf, slot, self.slot_bytes, a.shape)[...] = a
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def view(
+    buf: memoryview,
+    slot: int,
+    slot_bytes: int,
+    shape: tuple
+) -> numpy.ndarray:
+    return numpy.ndarray(
+        shape,
+        dtype=numpy.uint8,
+        buffer=buf,
+        offset=slot * slot_bytes
+    )
+
+
+def _work(
+    index: int,
+    ring_name: str,
+    slot_bytes: int,
+    engines: list[OCREngine],
+    tasks,
+    results,
+    cpus: list[int] | None = None,
+):
+    """Worker process main loop."""
+    if cpus:
+        pin(cpus)
+    shm = SharedMemory(name=ring_name)
+    for engine in engines:
+        engine.setup()
+    results.put(('ready', index, None, None))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, kind, slot, shape, mode, key = task
+        a = view(shm.buf, slot, slot_bytes, shape)
+        img = Image.fromarray(a)
+        if mode == '1':
+            img = img.convert('1')
+        output = []
+        errors = []
+        if kind == 'boxes':
+            engines_used = engines[:1]
+        else:
+            engines_used = engines
+        for engine in engines_used:
+            try:
+                if kind == 'boxes':
+                    output.extend(
+                        (b.x0, b.y0, b.x1, b.y1, b.text, b.confidence)
+                        for b in engine.recognize_boxes(img)
+                    )
+                else:
+                    output.extend(
+                        (r.text, r.confidence, r.engine)
+                        for r in engine.recognize(img, key)
+                    )
+            except Exception as e:
+                errors.append((engine.name, str(e)))
+        # Drop every reference to the slot before it is handed back
+        del img, a
+        results.put(('done', index, task_id, (output, errors)))
+    shm.close()
+
+
+class Worker:
+
+    def __init__(self, index: int, process, tasks):
+        self.index = index
+        self.process = process
+        self.tasks = tasks
+        self.ready = False
+        # task_id -> (start time, timeout)
+        self.pending = {}
+
+
+class OCRProcessPool:
+    """
+    Run the OCR engines in worker processes.
+
+    Frames are written to a `FrameRing` and workers copy them out of the
+    shared memory into an image, so images are never pickled. Only text and
+    confidences come back. Every worker runs all engines on its frame, one
+    after the other, so a frame may take the sum of their timeouts. Frames
+    of the same `key` go to the same worker when it is idle, so per-area
+    engine state such as EasyOCR's cached text boxes is reused.
+
+    A worker that dies, or that takes longer than `hang_factor` times the
+    timeout of a frame, is replaced. Its frames fail, and their slots
+    return to the ring only then, so a slot is never rewritten while a
+    worker may still read it.
+
+    Args:
+        engines (Iterable[OCREngine]): Engines to copy to each worker, not
+            set up yet.
+        processes (int): The number of worker processes.
+        slots (int): The number of frames in flight, default twice the
+            number of processes.
+        slot_mb (float): The size limit of one frame in megabytes.
+        cpus (list[list[int]]): The CPUs to pin each worker to, from
+            `ThreadBudget.worker_cpus`. Workers are not pinned by default.
+    """
+
+    processes: int = 2
+    slot_mb: float = 4.0
+    hang_factor: float = 3.0
+    max_restarts: int = 5
+
+    def __init__(
+        self,
+        engines: Iterable[OCREngine],
+        processes: int = processes,
+        slots: int | None = None,
+        slot_mb: float = slot_mb,
+        cpus: list[list[int]] | None = None,
+    ):
+        self.engines = list(engines)
+        if not self.engines:
+            raise ValueError('No OCR engines enabled')
+        # Text runs every engine in turn, boxes only the first
+        self.timeouts = {
+            'text': sum(e.timeout for e in self.engines),
+            'boxes': self.engines[0].timeout,
+        }
+        self.timeout = self.timeouts['text']
+        self.processes = processes
+        self.cpus = cpus
+        self.ring = FrameRing(
+            slots or 2 * processes,
+            int(slot_mb * 2 ** 20)
+        )
+        # 'spawn' does not copy the GUI and model threads of this process
+        self.context = get_context('spawn')
+        self.results = self.context.Queue()
+        self.workers = []
+        self.futures = {}
+        self.slots = {}
+        self.lock = Lock()
+        self.task_id = 0
+        self.closed = False
+        self._collector = None
+        self.counters = {
+            'frames': 0,
+            'failed_frames': 0,
+            'dropped_frames': 0,
+            'worker_restarts': 0,
+        }
+
+    def _spawn(self, index: int) -> Worker:
+        tasks = self.context.Queue()
+        process = self.context.Process(
+            target=_work,
+            args=(
+                index,
+                self.ring.name,
+                self.ring.slot_bytes,
+                self.engines,
+                tasks,
+                self.results,
+                self.cpus[index] if self.cpus else None,
+            ),
+            name=f'ocr-worker-{index}',
+            daemon=True,
+        )
+        process.start()
+        return Worker(index, process, tasks)
+
+    def start(self):
+        with self.lock:
+            if self.workers:
+                return
+            self.workers = [
+                self._spawn(i)
+                for i in range(self.processes)
+            ]
+        self._collector = Thread(
+            target=self._collect,
+            name='ocr-collector',
+            daemon=True
+        )
+        self._collector.start()
+
+    def warmup(self):
+        """Start the workers and wait until their engines are set up."""
+        start = perf_counter()
+        self.start()
+        deadline = start + self.timeout * self.hang_factor
+        while (
+            not all(w.ready for w in self.workers)
+            and perf_counter() < deadline
+        ):
+            sleep(0.05)
+        log.info({
+            'message': 'OCR workers started',
+            'engines': [e.name for e in self.engines],
+            'workers': sum(w.ready for w in self.workers),
+            'seconds': perf_counter() - start,
+        })
+
+    def _collect(self):
+        while not self.closed:
+            try:
+                kind, index, task_id, payload = self.results.get(timeout=0.5)
+            except Empty:
+                self._check_workers_safely()
+                continue
+            except (EOFError, OSError):
+                break
+            try:
+                with self.lock:
+                    worker = self.workers[index]
+                    if kind == 'ready':
+                        worker.ready = True
+                        continue
+                    worker.pending.pop(task_id, None)
+                self._finish(task_id, payload)
+            except Exception as e:
+                # The thread must outlive any one result, or futures are
+                # never resolved and slots never return to the ring
+                log.error({
+                    'message': 'OCR result not handled',
+                    'error': str(e),
+                })
+            self._check_workers_safely()
+
+    def _check_workers_safely(self):
+        try:
+            self._check_workers()
+        except Exception as e:
+            log.error({
+                'message': 'OCR worker check failed',
+                'error': str(e),
+            })
+
+    def _finish(self, task_id: int, payload):
+        future = self.futures.pop(task_id, None)
+        slot = self.slots.pop(task_id, None)
+        if slot is not None:
+            self.ring.release(slot)
+        if future is not None and not future.done():
+            future.set_result(payload)
+
+    def _check_workers(self):
+        now = perf_counter()
+        with self.lock:
+            workers = [(w, list(w.pending.values())) for w in self.workers]
+        for worker, started_times in workers:
+            hung = any(
+                now - started > timeout * self.hang_factor
+                for started, timeout in started_times
+            )
+            if worker.process.is_alive() and not hung:
+                continue
+            if hung:
+                worker.process.kill()
+                worker.process.join(1.0)
+            log.warning({
+                'message': 'OCR worker died' if not hung else 'OCR worker hung',
+                'worker': worker.index,
+                'exitcode': worker.process.exitcode,
+                'frames': len(worker.pending),
+            })
+            with self.lock:
+                pending = list(worker.pending)
+                worker.pending.clear()
+            # The process is gone, nothing reads its slots any more
+            for task_id in pending:
+                self.counters['failed_frames'] += 1
+                self._finish(task_id, None)
+            if self.closed:
+                continue
+            if self.counters['worker_restarts'] >= self.max_restarts:
+                log.error({
+                    'message': 'OCR worker not restarted, too many restarts',
+                    'worker': worker.index,
+                })
+                continue
+            self.counters['worker_restarts'] += 1
+            with self.lock:
+                self.workers[worker.index] = self._spawn(worker.index)
+
+    def _pick(self, key) -> Worker | None:
+        alive = [w for w in self.workers if w.process.is_alive()]
+        if not alive:
+            return None
+        if key is not None:
+            # Images of one area go to one worker, wherever they were taken
+            area = getattr(key, 'area', key)
+            preferred = self.workers[hash(area) % len(self.workers)]
+            if preferred in alive and not preferred.pending:
+                return preferred
+        # An idle worker first, then the one whose oldest frame is the most
+        # recent, as an old frame may be stalling its worker
+        return min(alive, key=lambda w: (
+            len(w.pending),
+            -min((s for s, _ in w.pending.values()), default=0),
+        ))
+
+    def _submit(self, kind: str, img: Image, key=None) -> Future | None:
+        self.start()
+        slot = self.ring.acquire(timeout=self.timeout)
+        if slot is None:
+            self.counters['dropped_frames'] += 1
+            log.warning({'message': 'No free OCR frame slot, dropping frame'})
+            return None
+        try:
+            a, mode = frame_array(img)
+            self.ring.write(slot, a)
+        except ValueError:
+            self.ring.release(slot)
+            raise
+        future = Future()
+        with self.lock:
+            worker = self._pick(key)
+            if worker is None:
+                self.ring.release(slot)
+                self.counters['dropped_frames'] += 1
+                return None
+            self.task_id += 1
+            task_id = self.task_id
+            self.futures[task_id] = future
+            self.slots[task_id] = slot
+            worker.pending[task_id] = (perf_counter(), self.timeouts[kind])
+            worker.tasks.put((task_id, kind, slot, a.shape, mode, key))
+        self.counters['frames'] += 1
+        return future
+
+    def _result(self, kind: str, img: Image, key=None):
+        try:
+            future = self._submit(kind, img, key)
+        except ValueError as e:
+            log.warning({
+                'message': 'OCR frame too large',
+                'error': str(e),
+            })
+            return []
+        if future is None:
+            return []
+        try:
+            payload = future.result(timeout=self.timeouts[kind])
+        except TimeoutError:
+            log.warning({
+                'message': 'OCR worker timed out',
+                'timeout': self.timeouts[kind],
+            })
+            return []
+        if payload is None:
+            return []
+        output, errors = payload
+        for engine, error in errors:
+            log.warning({
+                'message': 'OCR engine failed',
+                'engine': engine,
+                'error': error,
+            })
+        return output
+
+    def recognize(self, img: Image, key=None) -> list[OCRResult]:
+        results = [
+            OCRResult(*r)
+            for r in self._result('text', img, key)
+        ]
+        log.debug({
+            'message': 'OCR results',
+            'results': [repr(r) for r in results],
+        })
+        return results
+
+    def recognize_boxes(self, img: Image) -> list[TextBox]:
+        """Text boxes from the first engine, the others are not fused."""
+        return [
+            TextBox(*b)
+            for b in self._result('boxes', img)
+        ]
+
+    def metrics(self) -> dict:
+        return {
+            **self.counters,
+            'workers': sum(w.process.is_alive() for w in self.workers),
+            'free_slots': len(self.ring.free),
+        }
+
+    def close(self):
+        self.closed = True
+        for worker in self.workers:
+            if worker.process.is_alive():
+                worker.tasks.put(None)
+        for worker in self.workers:
+            worker.process.join(1.0)
+            if worker.process.is_alive():
+                worker.process.kill()
+        self.ring.close()
+
+    def __call__(self, img: Image, key=None) -> str:
+        return fuse(self.recognize(img, key))